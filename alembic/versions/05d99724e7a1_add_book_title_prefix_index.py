@@ -0,0 +1,50 @@
+"""add book title prefix index
+
+Revision ID: 05d99724e7a1
+Revises: e3315b185907
+Create Date: 2026-10-19 16:20:08.311742
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '05d99724e7a1'
+down_revision: Union[str, None] = 'e3315b185907'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match app.models.normalize_name / NameKey (kept inline so the migration never changes)
+def normalize_name(value: str) -> str:
+    return " ".join(value.split()).casefold()
+
+NAME_KEY = sa.String().with_variant(postgresql.VARCHAR(collation='C'), 'postgresql')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Serves GET /books/suggest?field=title for users without an in-memory index,
+    # on the same key as that index (casefolded, whitespace collapsed)
+    op.add_column('books', sa.Column('title_key', NAME_KEY, nullable=True))
+    bind = op.get_bind()
+    books = sa.table('books', sa.column('id', sa.Integer), sa.column('title_key', sa.String))
+    titles = bind.execute(sa.text("SELECT id, book_name FROM books")).all()
+    if titles:
+        bind.execute(
+            sa.update(books).where(books.c.id == sa.bindparam('book_id')).values(title_key=sa.bindparam('key')),
+            [{'book_id': book_id, 'key': normalize_name(title)} for book_id, title in titles]
+        )
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.alter_column('title_key', existing_type=NAME_KEY, nullable=False)
+    op.create_index('ix_books_user_id_title_key', 'books', ['user_id', 'title_key'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_books_user_id_title_key', table_name='books')
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.drop_column('title_key')
@@ -0,0 +1,54 @@
+"""add completed_at and tasks_archive
+
+Revision ID: 120c0905b251
+Revises: 2491764d94b4
+Create Date: 2026-10-19 11:27:40.533190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '120c0905b251'
+down_revision: Union[str, None] = '2491764d94b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tasks', sa.Column('completed_at', sa.DateTime(), nullable=True))
+
+    # Tasks completed before this migration start aging from now
+    op.execute("UPDATE tasks SET completed_at = CURRENT_TIMESTAMP WHERE completed")
+
+    op.create_index('ix_tasks_completed_completed_at', 'tasks', ['completed', 'completed_at'], unique=False)
+    op.create_table('tasks_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('description', sa.String(), nullable=True),
+    sa.Column('completed', sa.Boolean(), nullable=True),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tasks_archive_user_id', 'tasks_archive', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Bring archived tasks back before dropping the archive
+    op.execute(
+        "INSERT INTO tasks (id, title, description, completed, completed_at, user_id) "
+        "SELECT id, title, description, completed, completed_at, user_id FROM tasks_archive"
+    )
+    op.drop_index('ix_tasks_archive_user_id', table_name='tasks_archive')
+    op.drop_table('tasks_archive')
+    op.drop_index('ix_tasks_completed_completed_at', table_name='tasks')
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('completed_at')
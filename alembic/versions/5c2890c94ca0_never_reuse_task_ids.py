@@ -0,0 +1,49 @@
+"""never reuse task ids
+
+Revision ID: 5c2890c94ca0
+Revises: 05d99724e7a1
+Create Date: 2026-10-20 09:12:44.120931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2890c94ca0'
+down_revision: Union[str, None] = '05d99724e7a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # PostgreSQL sequences never hand out an id twice; SQLite without
+    # AUTOINCREMENT reuses the highest id once it left `tasks` for the archive
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    with op.batch_alter_table('tasks', recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+        pass
+
+    # Start after every id already handed out, archived ones included
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'tasks', 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'tasks')"
+    )
+    op.execute(
+        "UPDATE sqlite_sequence SET seq = MAX(seq, "
+        "(SELECT COALESCE(MAX(id), 0) FROM tasks), (SELECT COALESCE(MAX(id), 0) FROM tasks_archive)) "
+        "WHERE name = 'tasks'"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    with op.batch_alter_table('tasks', recreate='always', table_kwargs={'sqlite_autoincrement': False}):
+        pass
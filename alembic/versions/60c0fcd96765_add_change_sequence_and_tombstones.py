@@ -0,0 +1,60 @@
+"""add change sequence and tombstones
+
+Revision ID: 60c0fcd96765
+Revises: 75c96fe52dd2
+Create Date: 2026-10-19 09:12:04.118532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '60c0fcd96765'
+down_revision: Union[str, None] = '75c96fe52dd2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('books', sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('tasks', sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+
+    # Existing rows become change #1 of their owner, so a full sync (since=0) returns them
+    op.execute("UPDATE books SET change_seq = 1")
+    op.execute("UPDATE tasks SET change_seq = 1")
+    op.execute("UPDATE users SET change_seq = 1")
+
+    op.create_index('ix_books_user_id_change_seq', 'books', ['user_id', 'change_seq'], unique=False)
+    op.create_index('ix_tasks_user_id_change_seq', 'tasks', ['user_id', 'change_seq'], unique=False)
+
+    op.create_table('tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('change_seq', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_tombstones_id'), 'tombstones', ['id'], unique=False)
+    op.create_index('ix_tombstones_user_id_entity_change_seq', 'tombstones', ['user_id', 'entity', 'change_seq'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tombstones_user_id_entity_change_seq', table_name='tombstones')
+    op.drop_index(op.f('ix_tombstones_id'), table_name='tombstones')
+    op.drop_table('tombstones')
+    op.drop_index('ix_tasks_user_id_change_seq', table_name='tasks')
+    op.drop_index('ix_books_user_id_change_seq', table_name='books')
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('change_seq')
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.drop_column('change_seq')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('change_seq')
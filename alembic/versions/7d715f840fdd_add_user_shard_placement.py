@@ -0,0 +1,32 @@
+"""add user shard placement
+
+Revision ID: 7d715f840fdd
+Revises: 120c0905b251
+Create Date: 2026-10-19 13:05:12.870014
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d715f840fdd'
+down_revision: Union[str, None] = '120c0905b251'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing users keep their data where it is: NULL means the "default" shard
+    op.add_column('users', sa.Column('shard', sa.String(), nullable=True))
+    op.add_column('users', sa.Column('shard_moving', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('shard_moving')
+        batch_op.drop_column('shard')
@@ -0,0 +1,106 @@
+"""normalise authors and publishers
+
+Revision ID: e3315b185907
+Revises: 7d715f840fdd
+Create Date: 2026-10-19 15:42:31.604127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3315b185907'
+down_revision: Union[str, None] = '7d715f840fdd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Must match app.models.normalize_name / NameKey (kept inline so the migration never changes)
+def normalize_name(value: str) -> str:
+    return " ".join(value.split()).casefold()
+
+NAME_KEY = sa.String().with_variant(postgresql.VARCHAR(collation='C'), 'postgresql')
+
+
+def _fill_catalog(column: str, table: str):
+    """
+    Creates one catalog row per distinct spelling found in books.<column>
+    and points books at it
+    """
+    bind = op.get_bind()
+    spellings = bind.execute(sa.text(f"SELECT DISTINCT {column} FROM books ORDER BY {column}")).scalars().all()
+
+    catalog = sa.table(table, sa.column('id', sa.Integer), sa.column('spelling', sa.String), sa.column('name', sa.String))
+    rows = [
+        {'id': entry_id, 'spelling': spelling, 'name': normalize_name(spelling)}
+        for entry_id, spelling in enumerate(spellings, start=1)
+    ]
+    if rows:
+        op.bulk_insert(catalog, rows)
+
+    # One pass over books, each lookup on the catalog's unique spelling index
+    op.execute(f"UPDATE books SET {column}_id = (SELECT id FROM {table} WHERE {table}.spelling = books.{column})")
+
+    if bind.dialect.name == 'postgresql' and rows:
+        op.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('authors',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('spelling', sa.String(), nullable=False),
+    sa.Column('name', NAME_KEY, nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('spelling')
+    )
+    op.create_index(op.f('ix_authors_name'), 'authors', ['name'], unique=False)
+    op.create_table('publishers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('spelling', sa.String(), nullable=False),
+    sa.Column('name', NAME_KEY, nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('spelling')
+    )
+    op.create_index(op.f('ix_publishers_name'), 'publishers', ['name'], unique=False)
+    op.add_column('books', sa.Column('author_id', sa.Integer(), nullable=True))
+    op.add_column('books', sa.Column('publisher_id', sa.Integer(), nullable=True))
+
+    _fill_catalog('author', 'authors')
+    _fill_catalog('publisher', 'publishers')
+
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.alter_column('author_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('publisher_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_books_author_id_authors', 'authors', ['author_id'], ['id'])
+        batch_op.create_foreign_key('fk_books_publisher_id_publishers', 'publishers', ['publisher_id'], ['id'])
+        batch_op.drop_column('author')
+        batch_op.drop_column('publisher')
+    op.create_index('ix_books_user_id_author_id', 'books', ['user_id', 'author_id'], unique=False)
+    op.create_index('ix_books_user_id_publisher_id', 'books', ['user_id', 'publisher_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Catalog entries are exact spellings, so books get back what was entered
+    op.add_column('books', sa.Column('author', sa.String(), nullable=True))
+    op.add_column('books', sa.Column('publisher', sa.String(), nullable=True))
+    op.execute("UPDATE books SET author = (SELECT spelling FROM authors WHERE authors.id = books.author_id)")
+    op.execute("UPDATE books SET publisher = (SELECT spelling FROM publishers WHERE publishers.id = books.publisher_id)")
+
+    op.drop_index('ix_books_user_id_publisher_id', table_name='books')
+    op.drop_index('ix_books_user_id_author_id', table_name='books')
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.alter_column('author', existing_type=sa.String(), nullable=False)
+        batch_op.alter_column('publisher', existing_type=sa.String(), nullable=False)
+        batch_op.drop_constraint('fk_books_publisher_id_publishers', type_='foreignkey')
+        batch_op.drop_constraint('fk_books_author_id_authors', type_='foreignkey')
+        batch_op.drop_column('publisher_id')
+        batch_op.drop_column('author_id')
+    op.drop_index(op.f('ix_publishers_name'), table_name='publishers')
+    op.drop_table('publishers')
+    op.drop_index(op.f('ix_authors_name'), table_name='authors')
+    op.drop_table('authors')
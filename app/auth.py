@@ -1,6 +1,8 @@
 
 from datetime import datetime, timedelta 
 from jose import JWTError, jwt           
+import os
+import secrets
 
 # -----------------
 # JWT Configuration
@@ -14,6 +16,10 @@ ALGORITHM = "HS256"
 # Default token expiry time (30 minutes)
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Shared secret for admin endpoints and on-demand profiling (sent as X-Admin-Token).
+# Admin features are disabled when unset.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # -----------------
 # Token Creation Function
 
@@ -53,3 +59,15 @@ def verify_token(token: str):
         return payload
     except JWTError:
         return None  # Invalid signature or token is expired
+
+# -----------------
+# Admin Token Check
+
+def is_admin_token(token: str | None) -> bool:
+    """
+    Checks a client-supplied admin token against ADMIN_TOKEN (constant-time comparison).
+    Always False while ADMIN_TOKEN is not configured.
+    """
+    if not ADMIN_TOKEN or not token:
+        return False
+    return secrets.compare_digest(token, ADMIN_TOKEN)
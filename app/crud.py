@@ -1,26 +1,37 @@
+from datetime import datetime
+from sqlalchemy import select, update, insert, delete, union_all, false
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session 
-from . import models, schemas 
+from . import models, schemas, database, suggest
 from typing import List       
 from fastapi import HTTPException, status 
-from passlib.context import CryptContext  
+from .hashing import pwd_context
 from .models import User, Task
 from .schemas import UserCreate, TaskCreate
 
 # -------------------------
 # BOOKS SECTION
 
-def create_book(db: Session, book: schemas.BookCreate, user_id: int):
-    db_book = models.Book(
+def build_book(db: Session, book: schemas.BookCreate, user_id: int) -> models.Book:
+    """
+    New Book row for `book`, with its author/publisher resolved in the catalog
+    """
+    return models.Book(
         book_name=book.book_name,
         description=book.description,
         pages=book.pages,
-        author=book.author,
-        publisher=book.publisher,
-        user_id=user_id
+        author_id=catalog_id(db, models.Author, book.author),
+        publisher_id=catalog_id(db, models.Publisher, book.publisher),
+        user_id=user_id,
+        change_seq=next_change_seq(db, user_id)
     )
+
+
+def create_book(db: Session, book: schemas.BookCreate, user_id: int):
+    db_book = build_book(db, book, user_id)
     db.add(db_book)
-    db.commit()
-    db.refresh(db_book)
+    database.commit_loaded(db, db_book)
+    suggest.cache.book_written(user_id, db_book)
     return db_book
 
 
@@ -31,8 +42,14 @@ def get_books(
     author: str = None,
     publisher: str = None,
     sort_by: str = "id",
-    sort_order: str = "asc"
+    sort_order: str = "asc",
+    match: str = "contains"
 ) -> List[models.Book]:
+    """
+    match="contains": author/publisher filters are case-insensitive substrings
+    match="exact": they must equal the (normalised) name, answered from the
+    (user_id, author_id) / (user_id, publisher_id) indexes
+    """
     # Start with current user's books only
     query = db.query(models.Book).filter(models.Book.user_id == user_id)
 
@@ -40,9 +57,9 @@ def get_books(
     if name:
         query = query.filter(models.Book.book_name.ilike(f"%{name}%"))
     if author:
-        query = query.filter(models.Book.author.ilike(f"%{author}%"))
+        query = query.filter(catalog_filter(db, models.Book.author_id, models.Author, author, match))
     if publisher:
-        query = query.filter(models.Book.publisher.ilike(f"%{publisher}%"))
+        query = query.filter(catalog_filter(db, models.Book.publisher_id, models.Publisher, publisher, match))
 
     # sorting
     sort_column = getattr(models.Book, sort_by, models.Book.id)
@@ -55,22 +72,55 @@ def get_books(
 
 
 
+def catalog_id(db: Session, model, spelling: str) -> int:
+    """
+    Id of the models.Author / models.Publisher entry for `spelling`, created on first use.
+    Concurrent creators of the same spelling end up with the same row.
+    """
+    entry_id = db.execute(select(model.id).where(model.spelling == spelling)).scalar()
+    if entry_id is not None:
+        return entry_id
+
+    values = {"spelling": spelling, "name": models.normalize_name(spelling)}
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        db.execute(dialect_insert(model).values(**values).on_conflict_do_nothing(index_elements=["spelling"]))
+    else:
+        db.execute(insert(model).values(**values))
+    return db.execute(select(model.id).where(model.spelling == spelling)).scalar()
+
+
+def catalog_filter(db: Session, column, model, value: str, match: str = "contains"):
+    """
+    Filter on a book's catalog column (Book.author_id / Book.publisher_id).
+    Names are only searched in the (small) catalog table, never per book row.
+    """
+    key = models.normalize_name(value)
+    if match == "exact":
+        # Resolved once (one id per spelling), so the books query is a plain integer lookup
+        entry_ids = db.execute(select(model.id).where(model.name == key)).scalars().all()
+        return column.in_(entry_ids) if entry_ids else false()
+    return column.in_(select(model.id).where(model.name.contains(key, autoescape=True)))
+
+
 def delete_book(db: Session, book_id: int, user_id: int):
     book = db.query(models.Book).filter(models.Book.id == book_id, models.Book.user_id == user_id).first()
 
     if not book:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
 
+    change_seq = record_deletion(db, "book", book_id, user_id).change_seq
     db.delete(book)
     db.commit()
+    suggest.cache.book_deleted(user_id, book_id, change_seq)
     return {"message": f"Book with id {book_id} deleted successfully"}
 
 
 # -------------------------
 # USER AUTHENTICATION SECTION
 
-# Setup for password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing policy lives in hashing.py (shared with login)
 
 def get_password_hash(password: str) -> str:
     """
@@ -84,31 +134,61 @@ def create_user(db: Session, user: UserCreate):
     Adds a new user with a hashed password to the users table.
     """
     hashed_password = get_password_hash(user.password)
-    db_user = User(username=user.username, hashed_password=hashed_password)
+    db_user = User(
+        username=user.username,
+        hashed_password=hashed_password,
+        shard=database.shard_ring.shard_for(user.username)
+    )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    database.commit_loaded(db, db_user)
+    mirror_user(db_user)
     return db_user
 
 
+def mirror_user(user: User, change_seq: int = 0):
+    """
+    Copies the user's row into its home shard, where it anchors the foreign
+    keys of books/tasks and holds the user's change sequence counter.
+    Nothing to do when the home shard is the directory database itself.
+    """
+    shard_session = database.get_shard_sessionmaker(user.shard)
+    if shard_session is database.SessionLocal:
+        return
+    with shard_session() as db:
+        db.merge(User(id=user.id, username=user.username, hashed_password="!", change_seq=change_seq))
+        db.commit()
+
+
 def get_user_by_username(db: Session, username: str):
     """
     Retrieves a user by their username (used for login and validation).
     """
     return db.query(User).filter(User.username == username).first()
 
+
+def update_password_hash(db: Session, user: User, hashed_password: str):
+    """
+    Stores a password hash recomputed with the current hashing policy.
+    """
+    user.hashed_password = hashed_password
+    db.commit()
+
 # -------------------------
 # TASKS SECTION
 
-def create_task(db: Session, task: TaskCreate, user_id: int):
+def create_task(db: Session, task: TaskCreate, user_id: int, commit: bool = True):
     """
     Creates a new task for the logged-in user.
+    commit=False only flushes, leaving the commit to the caller (see groupcommit.py).
     """
-    db_task = Task(**task.dict(), user_id=user_id)
+    db_task = Task(
+        **task.dict(),
+        completed_at=datetime.utcnow() if task.completed else None,
+        user_id=user_id,
+        change_seq=next_change_seq(db, user_id)
+    )
     db.add(db_task)
-    db.commit()
-    db.refresh(db_task)
-    return db_task
+    return _finish_write(db, db_task, commit)
 
 
 def get_tasks_for_user(db: Session, user_id: int, skip: int = 0, limit: int = 10):
@@ -126,7 +206,7 @@ def get_tasks_for_user(db: Session, user_id: int, skip: int = 0, limit: int = 10
     )
 
 
-def update_task(db: Session, task_id: int, user_id: int, task_update: schemas.TaskUpdate):
+def update_task(db: Session, task_id: int, user_id: int, task_update: schemas.TaskUpdate, commit: bool = True):
     """
     Updates a task only if it belongs to the current user.
     """
@@ -137,23 +217,217 @@ def update_task(db: Session, task_id: int, user_id: int, task_update: schemas.Ta
 
     # Only update fields provided in request
     update_data = task_update.dict(exclude_unset=True)
+    if "completed" in update_data and update_data["completed"] != task.completed:
+        task.completed_at = datetime.utcnow() if update_data["completed"] else None
     for key, value in update_data.items():
         setattr(task, key, value)
+    task.change_seq = next_change_seq(db, user_id)
+    return _finish_write(db, task, commit)
 
-    db.commit()
-    db.refresh(task)
+
+def complete_task(db: Session, task_id: int, user_id: int, commit: bool = True):
+    """
+    Marks a task as completed (keeping the first completion time).
+    """
+    task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.user_id == user_id).first()
+
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    if not task.completed:
+        task.completed_at = datetime.utcnow()
+    task.completed = True
+    task.change_seq = next_change_seq(db, user_id)
+    return _finish_write(db, task, commit)
+
+
+def _finish_write(db: Session, task: Task, commit: bool):
+    if commit:
+        database.commit_loaded(db, task)
+    else:
+        db.flush()
     return task
 
 
 def delete_task(db: Session, task_id: int, user_id: int):
     """
-    Deletes a task only if it belongs to the current user.
+    Deletes a task only if it belongs to the current user, archived ones included.
     """
     task = db.query(models.Task).filter(models.Task.id == task_id, models.Task.user_id == user_id).first()
+    if not task:
+        task = db.query(models.TaskArchive).filter(
+            models.TaskArchive.id == task_id, models.TaskArchive.user_id == user_id
+        ).first()
 
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
+    record_deletion(db, "task", task_id, user_id)
     db.delete(task)
     db.commit()
     return {"message": f"Task with id {task_id} deleted successfully"}
+
+
+def get_tasks_including_archived(
+    db: Session,
+    user_id: int,
+    completed: bool = None,
+    title: str = None,
+    sort_by: str = "id",
+    sort_order: str = "asc",
+    skip: int = 0,
+    limit: int = 10
+):
+    """
+    Same filters, sorting and pagination as GET /tasks/, over `tasks` and
+    `tasks_archive` together (UNION ALL, sorted and paged in the database).
+    """
+    def task_select(model):
+        stmt = select(
+            model.id, model.title, model.description, model.completed, model.completed_at, model.user_id
+        ).where(model.user_id == user_id)
+        if completed is not None:
+            stmt = stmt.where(model.completed == completed)
+        if title:
+            stmt = stmt.where(model.title.ilike(f"%{title}%"))
+        return stmt
+
+    tasks = union_all(task_select(models.Task), task_select(models.TaskArchive)).subquery()
+
+    sort_column = tasks.c.get(sort_by, tasks.c.id)
+    sort_column = sort_column.desc() if sort_order == "desc" else sort_column.asc()
+
+    return db.execute(
+        select(tasks).order_by(sort_column).offset(skip).limit(limit)
+    ).all()
+
+
+# -------------------------
+# TASK ARCHIVE SECTION
+
+def archive_completed_tasks(
+    db: Session,
+    completed_before: datetime,
+    batch_size: int = 500,
+    user_id: int = None,
+    skip_users: list = ()
+) -> int:
+    """
+    Moves one batch of tasks completed before `completed_before` into
+    `tasks_archive` and commits. Returns the number of moved tasks
+    (0 once there is nothing left to archive). Tasks of `skip_users` are left alone.
+    """
+    query = db.query(models.Task.id).filter(
+        models.Task.completed == True,
+        models.Task.completed_at < completed_before
+    )
+    if user_id is not None:
+        query = query.filter(models.Task.user_id == user_id)
+    if skip_users:
+        query = query.filter(models.Task.user_id.not_in(skip_users))
+    ids = [task_id for (task_id,) in query.order_by(models.Task.completed_at).limit(batch_size)]
+    if not ids:
+        return 0
+
+    # Archived tasks leave `tasks`: tombstones let delta sync clients drop them.
+    # Sequence numbers are taken first, users in id order, before any task row is locked
+    owners = {}
+    for task_id, owner_id in db.execute(select(models.Task.id, models.Task.user_id).where(models.Task.id.in_(ids))):
+        owners.setdefault(owner_id, []).append(task_id)
+    tombstones = []
+    for owner_id in sorted(owners):
+        last_seq = next_change_seq(db, owner_id, count=len(owners[owner_id]))
+        first_seq = last_seq - len(owners[owner_id]) + 1
+        tombstones += [
+            {"entity": "task", "entity_id": task_id, "user_id": owner_id, "change_seq": first_seq + i}
+            for i, task_id in enumerate(owners[owner_id])
+        ]
+
+    columns = ["id", "title", "description", "completed", "completed_at", "user_id"]
+    db.execute(
+        insert(models.TaskArchive).from_select(
+            columns,
+            select(*[getattr(models.Task, c) for c in columns]).where(models.Task.id.in_(ids))
+        )
+    )
+    db.execute(insert(models.Tombstone), tombstones)
+    db.execute(delete(models.Task).where(models.Task.id.in_(ids)).execution_options(synchronize_session=False))
+    db.commit()
+    return len(ids)
+
+
+# -------------------------
+# DELTA SYNC SECTION
+
+def next_change_seq(db: Session, user_id: int, count: int = 1) -> int:
+    """
+    Hands out the next change sequence number for one of the user's rows
+    (with count > 1, a block of numbers ending at the returned one).
+    The UPDATE locks the user's row until commit, so sequence numbers
+    become visible to readers in the order they were handed out.
+    """
+    db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(change_seq=User.change_seq + count)
+        .execution_options(synchronize_session=False)
+    )
+    return db.execute(select(User.change_seq).where(User.id == user_id)).scalar_one()
+
+
+def record_deletion(db: Session, entity: str, entity_id: int, user_id: int):
+    """
+    Leaves a tombstone so delta sync clients learn about a deleted row.
+    """
+    tombstone = models.Tombstone(
+        entity=entity,
+        entity_id=entity_id,
+        user_id=user_id,
+        change_seq=next_change_seq(db, user_id)
+    )
+    db.add(tombstone)
+    return tombstone
+
+
+def get_changes(db: Session, model, entity: str, user_id: int, since: int = 0, limit: int = 500):
+    """
+    Returns rows and tombstones of one entity changed after the `since` watermark.
+    - Both lookups use the (user_id, change_seq) indexes, so the cost follows
+      the number of changes rather than the size of the user's library
+    - The new watermark is the last change sequence included in the page
+    - Both lookups stop at the user's counter, read first: every change up
+      to it has committed (see next_change_seq), so a change committing
+      between the two lookups can't be skipped by the watermark
+    """
+    counter = db.execute(select(User.change_seq).where(User.id == user_id)).scalar() or 0
+    rows = (
+        db.query(model)
+        .filter(model.user_id == user_id, model.change_seq > since, model.change_seq <= counter)
+        .order_by(model.change_seq)
+        .limit(limit + 1)
+        .all()
+    )
+    tombstones = (
+        db.query(models.Tombstone)
+        .filter(
+            models.Tombstone.user_id == user_id,
+            models.Tombstone.entity == entity,
+            models.Tombstone.change_seq > since,
+            models.Tombstone.change_seq <= counter
+        )
+        .order_by(models.Tombstone.change_seq)
+        .limit(limit + 1)
+        .all()
+    )
+
+    # Merge both streams in sequence order and cut the page at `limit`
+    merged = sorted(rows + tombstones, key=lambda item: item.change_seq)
+    page = merged[:limit]
+    watermark = page[-1].change_seq if page else since
+
+    return {
+        "changed": [item for item in page if isinstance(item, model)],
+        "deleted": [item.entity_id for item in page if isinstance(item, models.Tombstone)],
+        "watermark": watermark,
+        "has_more": len(merged) > limit
+    }
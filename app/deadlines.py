@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+# -------------------------
+# Deadline configuration
+
+# Default time budget of a request, in seconds
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "10"))
+
+# Upper bound for the X-Request-Timeout header a client may send
+REQUEST_DEADLINE_MAX_SECONDS = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", "30"))
+
+# Per-route budgets, e.g. ROUTE_DEADLINES={"/books/": 5, "/login": 3}
+ROUTE_DEADLINES = json.loads(os.getenv("ROUTE_DEADLINES", "{}"))
+
+# SQLite checks the deadline every this many VM instructions
+SQLITE_PROGRESS_STEPS = 10000
+
+# Deadline of the request being handled (propagates into threadpool workers)
+current_deadline = ContextVar("request_deadline", default=None)
+
+stats = {"timeouts": 0, "cancellations": 0, "interrupted_queries": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        stats[name] += 1
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised instead of starting a query once the request's deadline has passed
+    or its client has gone away
+    """
+
+
+class Deadline:
+    """
+    Time budget of one request. Cancelling it (timeout or client disconnect)
+    interrupts the queries it is running.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.reason = None                 # "timeout" or "disconnect" once cancelled
+        self._connections = set()          # DBAPI connections with a statement in flight
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def done(self) -> bool:
+        return self.reason is not None or time.monotonic() >= self.expires_at
+
+    def cancel(self, reason: str):
+        if self.reason is not None:
+            return
+        self.reason = reason
+        with self._lock:
+            connections = list(self._connections)
+        for dbapi_connection in connections:
+            # psycopg2 can abort a running statement from another thread; SQLite
+            # notices through its progress handler instead
+            cancel = getattr(dbapi_connection, "cancel", None)
+            if cancel is not None:
+                try:
+                    cancel()
+                except Exception:
+                    pass
+
+    def track(self, dbapi_connection):
+        with self._lock:
+            self._connections.add(dbapi_connection)
+
+    def untrack(self, dbapi_connection):
+        with self._lock:
+            self._connections.discard(dbapi_connection)
+
+
+def is_interruption(exc: BaseException) -> bool:
+    """
+    Whether `exc` comes from a query stopped by a deadline: refused before it
+    started, interrupted by SQLite's progress handler or cancelled by
+    PostgreSQL (statement_timeout / cancel request, SQLSTATE 57014)
+    """
+    if isinstance(exc, DeadlineExceeded) or isinstance(getattr(exc, "orig", None), DeadlineExceeded):
+        return True
+    if isinstance(exc, DBAPIError):
+        if getattr(exc.orig, "pgcode", None) == "57014":
+            return True
+        return "interrupted" in str(exc.orig)
+    return False
+
+
+def deadline_for(scope) -> float:
+    seconds = float(ROUTE_DEADLINES.get(scope["path"], REQUEST_DEADLINE_SECONDS))
+    for name, value in scope["headers"]:
+        if name == b"x-request-timeout":
+            try:
+                seconds = min(float(value), REQUEST_DEADLINE_MAX_SECONDS)
+            except ValueError:
+                pass
+    return seconds
+
+# -------------------------
+# Database hooks
+
+@event.listens_for(Engine, "connect")
+def _install_progress_handler(dbapi_connection, connection_record):
+    if hasattr(dbapi_connection, "set_progress_handler"):  # sqlite3
+        dbapi_connection.set_progress_handler(_sqlite_progress, SQLITE_PROGRESS_STEPS)
+
+
+def _sqlite_progress():
+    # Runs inside SQLite on the querying thread; a non-zero return interrupts the query
+    deadline = current_deadline.get()
+    if deadline is not None and deadline.done:
+        _count("interrupted_queries")
+        return 1
+    return 0
+
+
+@event.listens_for(Session, "after_begin")
+def _set_statement_timeout(session, transaction, connection):
+    deadline = current_deadline.get()
+    if deadline is not None and connection.dialect.name == "postgresql":
+        timeout_ms = max(1, int(deadline.remaining() * 1000))
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _check_deadline(conn, cursor, statement, parameters, context, executemany):
+    deadline = current_deadline.get()
+    if deadline is None:
+        return
+    if deadline.done:
+        raise DeadlineExceeded(deadline.reason or "timeout")
+    deadline.track(cursor.connection)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _untrack(conn, cursor, statement, parameters, context, executemany):
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.untrack(cursor.connection)
+
+# -------------------------
+# Middleware
+
+class DeadlineMiddleware:
+    """
+    Pure ASGI middleware giving every request a deadline.
+    - Answers 504 as soon as the deadline passes and interrupts the request's queries
+    - Interrupts the request's queries when the client disconnects early
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        deadline = Deadline(deadline_for(scope))
+        token = current_deadline.set(deadline)
+        state = {"started": False, "finished": False, "answered": False}
+        messages = asyncio.Queue()
+
+        async def watch_client():
+            # Forwards incoming messages to the app and notices a disconnect
+            # even when the app is not reading (e.g. while it waits on the DB)
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    if not state["finished"]:
+                        deadline.cancel("disconnect")
+                    return
+
+        async def send_wrapper(message):
+            if state["answered"]:
+                return  # 504 already sent on behalf of this request
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                state["finished"] = True
+            await send(message)
+
+        watcher = asyncio.ensure_future(watch_client())
+        app_task = asyncio.ensure_future(self.app(scope, messages.get, send_wrapper))
+        current_deadline.reset(token)
+
+        try:
+            done, _ = await asyncio.wait({app_task}, timeout=deadline.remaining())
+            if not done:
+                deadline.cancel("timeout")
+                if not state["started"]:
+                    await self._send_timeout(send)
+                    state["answered"] = True
+                await asyncio.wait({app_task})  # Let it unwind (its queries are being interrupted)
+
+            exc = app_task.exception()
+            if exc is not None:
+                if deadline.reason is None and (deadline.done or is_interruption(exc)):
+                    # The database stops the query right at expiry, which can
+                    # be a moment before the wait above times out
+                    deadline.cancel("timeout")
+                if deadline.reason is None:
+                    raise exc
+                if deadline.reason == "timeout" and not state["started"] and not state["answered"]:
+                    await self._send_timeout(send)
+        finally:
+            watcher.cancel()
+            if deadline.reason == "timeout":
+                _count("timeouts")
+            elif deadline.reason == "disconnect":
+                _count("cancellations")
+
+    @staticmethod
+    async def _send_timeout(send):
+        body = json.dumps({"detail": "Request deadline exceeded"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,160 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from . import deadlines
+from .database import DEFAULT_SHARD, get_shard_sessionmaker
+
+# -------------------------
+# Group commit configuration
+
+# Opt-in: task writes (create/update/complete) go through the batcher
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1"
+
+# A batch is committed this many milliseconds after its first write, or
+# as soon as it holds GROUP_COMMIT_MAX_BATCH writes
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "64"))
+
+_STOP = object()
+
+
+class _Write:
+    def __init__(self, func):
+        self.func = func
+        self.future = Future()
+
+
+class GroupCommitter:
+    """
+    Coalesces small writes from concurrent requests into one transaction per
+    shard, so a burst of N writes costs one commit (one fsync) instead of N.
+    - One flusher thread per shard, started on first use
+    - Each write runs in its own SAVEPOINT: a failing write (e.g. 404) is
+      rolled back alone and its error is raised in its own request
+    - run() returns only once the batch holding the write has committed
+    """
+
+    def __init__(self, window_ms: float = GROUP_COMMIT_WINDOW_MS, max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.stats = {"batches": 0, "writes": 0, "failed": 0, "retried": 0}
+        self._queues = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def run(self, shard: str | None, func):
+        """
+        Runs func(db) in the next batch of `shard` and returns its result.
+        func must not commit (crud functions take commit=False) and should
+        return plain data: the batch session is closed afterwards.
+        """
+        write = _Write(func)
+        self._queue(shard or DEFAULT_SHARD).put(write)
+        # Bounded by the request's deadline: a write still queued or in a
+        # batch then may or may not commit, like any timed out request
+        deadline = deadlines.current_deadline.get()
+        timeout = deadline.remaining() if deadline is not None else deadlines.REQUEST_DEADLINE_SECONDS
+        try:
+            return write.future.result(timeout=timeout)
+        except FutureTimeout:
+            raise deadlines.DeadlineExceeded("timeout") from None
+
+    def stop(self):
+        with self._lock:
+            threads = list(self._threads.values())
+            for q in self._queues.values():
+                q.put(_STOP)
+            self._queues.clear()
+            self._threads.clear()
+        for thread in threads:
+            thread.join()
+
+    def _queue(self, shard: str) -> queue.Queue:
+        with self._lock:
+            q = self._queues.get(shard)
+            if q is None:
+                q = self._queues[shard] = queue.Queue()
+                thread = threading.Thread(target=self._flush_forever, args=(shard, q), name=f"group-commit-{shard}", daemon=True)
+                self._threads[shard] = thread
+                thread.start()
+            return q
+
+    def _flush_forever(self, shard: str, q: queue.Queue):
+        stopping = False
+        while not stopping:
+            first = q.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            closes_at = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    write = q.get(timeout=max(0.0, closes_at - time.monotonic()))
+                except queue.Empty:
+                    break
+                if write is _STOP:
+                    stopping = True
+                    break
+                batch.append(write)
+            try:
+                self._commit_batch(shard, batch)
+            except Exception as exc:
+                # The batch could not even start (e.g. connection refused, or
+                # SQLITE_BUSY on BEGIN): fail its writes and keep serving the shard
+                for write in batch:
+                    if not write.future.done():
+                        self.stats["failed"] += 1
+                        write.future.set_exception(exc)
+
+    def _commit_batch(self, shard: str, batch: list):
+        done = []
+        with get_shard_sessionmaker(shard)() as db:
+            connection = db.connection()
+            if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:
+                # pysqlite only opens a transaction before DML; a SAVEPOINT sent
+                # first would become the transaction and commit on RELEASE.
+                # (Tuned SQLite engines already began one, see database.py.)
+                connection.exec_driver_sql("BEGIN")
+            for write in batch:
+                try:
+                    with db.begin_nested():
+                        result = write.func(db)
+                except Exception as exc:
+                    self.stats["failed"] += 1
+                    write.future.set_exception(exc)
+                else:
+                    done.append((write, result))
+            try:
+                db.commit()
+            except Exception:
+                db.rollback()
+                # The batch as a whole failed (e.g. a conflict at commit time):
+                # every write gets its own transaction so only the culprit fails
+                self.stats["retried"] += len(done)
+                for write, _ in done:
+                    self._commit_alone(shard, write)
+                return
+
+        self.stats["batches"] += 1
+        self.stats["writes"] += len(done)
+        for write, result in done:
+            write.future.set_result(result)
+
+    def _commit_alone(self, shard: str, write: _Write):
+        with get_shard_sessionmaker(shard)() as db:
+            try:
+                result = write.func(db)
+                db.commit()
+            except Exception as exc:
+                self.stats["failed"] += 1
+                write.future.set_exception(exc)
+            else:
+                self.stats["batches"] += 1
+                self.stats["writes"] += 1
+                write.future.set_result(result)
+
+
+committer = GroupCommitter()
@@ -0,0 +1,70 @@
+import os
+import statistics
+import time
+
+from passlib.context import CryptContext
+
+# -------------------------
+# Password hashing policy
+
+# Time one password hash should take on this host
+PASSWORD_HASH_TARGET_MS = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+
+# Bounds for the calibrated bcrypt cost (each extra round doubles the work)
+PASSWORD_HASH_MIN_ROUNDS = int(os.getenv("PASSWORD_HASH_MIN_ROUNDS", "10"))
+PASSWORD_HASH_MAX_ROUNDS = int(os.getenv("PASSWORD_HASH_MAX_ROUNDS", "16"))
+
+# Fixed cost, skipping calibration (e.g. to keep every pod on the same cost)
+PASSWORD_HASH_ROUNDS = os.getenv("PASSWORD_HASH_ROUNDS")
+
+# Shared by registration (crud.py) and login (main.py)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def measure_bcrypt_ms(rounds: int, samples: int = 3) -> float:
+    """
+    Median time (ms) of one bcrypt hash at the given cost on this host
+    """
+    context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.hash("calibration password")
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate_rounds(
+    target_ms: float = PASSWORD_HASH_TARGET_MS,
+    min_rounds: int = PASSWORD_HASH_MIN_ROUNDS,
+    max_rounds: int = PASSWORD_HASH_MAX_ROUNDS,
+    timer=measure_bcrypt_ms
+) -> int:
+    """
+    Highest bcrypt cost whose hash time stays within target_ms.
+    Measures once at min_rounds and extrapolates (cost doubles per round);
+    never goes below min_rounds, even on a host slower than the target.
+    """
+    base_ms = timer(min_rounds)
+    rounds = min_rounds
+    while rounds < max_rounds and base_ms * 2 ** (rounds + 1 - min_rounds) <= target_ms:
+        rounds += 1
+    return rounds
+
+
+def apply_policy(rounds: int):
+    """
+    New hashes use `rounds`; hashes made with fewer rounds are reported by
+    needs_update and rehashed at the next successful login. Stronger hashes
+    are left alone, so pods calibrated differently never downgrade each other.
+    """
+    pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+
+
+def configure_from_host() -> int:
+    """
+    Called at startup: picks the cost (fixed or calibrated) and applies it
+    """
+    rounds = int(PASSWORD_HASH_ROUNDS) if PASSWORD_HASH_ROUNDS else calibrate_rounds()
+    apply_policy(rounds)
+    return rounds
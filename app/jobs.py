@@ -0,0 +1,415 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException, status
+from sqlalchemy import func, insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from . import models, schemas, crud
+from .database import SessionLocal, shard_sessions, get_shard_sessionmaker, commit_loaded
+
+logger = logging.getLogger(__name__)
+
+# -------------------------
+# Job runner configuration
+
+# Worker threads shared by all users (global concurrency cap)
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+
+# Queued + running jobs allowed per user
+JOBS_MAX_PER_USER = int(os.getenv("JOBS_MAX_PER_USER", "2"))
+
+# Queued + running jobs allowed in total before submissions are refused
+JOBS_MAX_PENDING = int(os.getenv("JOBS_MAX_PENDING", "100"))
+
+# Minimum seconds between two progress writes of the same job
+PROGRESS_INTERVAL = 0.5
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# Transaction-level advisory lock taken by job submissions on PostgreSQL
+JOBS_SUBMIT_LOCK_KEY = 0x6A6F6273
+
+# Completed tasks older than this are moved to tasks_archive
+TASK_ARCHIVE_AFTER_DAYS = int(os.getenv("TASK_ARCHIVE_AFTER_DAYS", "30"))
+
+# Tasks moved per archiver transaction, and pause between two batches (throttling)
+TASK_ARCHIVE_BATCH_SIZE = int(os.getenv("TASK_ARCHIVE_BATCH_SIZE", "500"))
+TASK_ARCHIVE_PAUSE_SECONDS = float(os.getenv("TASK_ARCHIVE_PAUSE_SECONDS", "0.2"))
+
+# Seconds between two archiver sweeps over all users (0 disables the periodic sweep)
+TASK_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("TASK_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+# -------------------------
+# Handler registry
+
+JOB_HANDLERS = {}
+
+def job_handler(kind: str):
+    """
+    Registers a function as the handler for a job kind.
+    Handlers are called as handler(db, user_id, params, ctx) and return a JSON-serialisable result.
+    """
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a handler (by JobContext.progress) once a cancel was requested
+    """
+
+
+class UserDataMoving(Exception):
+    """
+    Raised inside a handler (by JobContext.checkpoint) while the user's data
+    is being moved to another shard: rows committed from now on could be
+    left behind on the old shard
+    """
+
+    def __init__(self):
+        super().__init__("User data is being moved between shards, retry later")
+
+
+class JobContext:
+    """
+    Handed to a running handler to report progress and notice cancellation.
+    Progress is written through its own short session so it is visible while
+    the handler's transaction is still open.
+    """
+
+    def __init__(self, job_id: int, user_id: int):
+        self.job_id = job_id
+        self.user_id = user_id
+        self._last_write = 0.0
+
+    def checkpoint(self):
+        """
+        Called by handlers before each batch they write to the shard
+        """
+        with SessionLocal() as db:
+            moving = db.execute(
+                select(models.User.shard_moving).where(models.User.id == self.user_id)
+            ).scalar()
+        if moving:
+            raise UserDataMoving()
+
+    def progress(self, done: int, total: int | None = None, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+
+        with SessionLocal() as db:
+            job = db.get(models.Job, self.job_id)
+            job.progress_done = done
+            if total is not None:
+                job.progress_total = total
+            cancel_requested = job.cancel_requested
+            db.commit()
+
+        if cancel_requested:
+            raise JobCancelled()
+
+# -------------------------
+# Runner
+
+class JobRunner:
+    """
+    Bounded in-process worker pool for jobs stored in the `jobs` table.
+    - Started/stopped from the app lifespan (see main.py)
+    - A job is claimed with a conditional UPDATE, so it never runs twice
+    """
+
+    def __init__(self, max_workers: int = JOBS_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="job-worker"
+                )
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def recover(self):
+        """
+        Called once at startup: jobs left running by a previous process are
+        marked failed, jobs still queued are handed to the pool again.
+        """
+        with SessionLocal() as db:
+            db.execute(
+                update(models.Job)
+                .where(models.Job.status == "running")
+                .values(status="failed", error="Interrupted by server restart", finished_at=datetime.utcnow())
+            )
+            db.commit()
+            queued = [job_id for (job_id,) in db.query(models.Job.id).filter(models.Job.status == "queued").order_by(models.Job.id)]
+
+        for job_id in queued:
+            self._dispatch(job_id)
+
+    def submit(self, db: Session, user_id: int, kind: str, params: dict) -> models.Job:
+        if kind not in JOB_HANDLERS:
+            raise HTTPException(status_code=400, detail=f"Unknown job kind '{kind}'")
+
+        if db.get_bind().dialect.name == "postgresql":
+            # Under READ COMMITTED two submits would both count the jobs before
+            # either inserts; SQLite already runs one write statement at a time
+            db.execute(select(func.pg_advisory_xact_lock(JOBS_SUBMIT_LOCK_KEY)))
+
+        # The caps are checked by the INSERT itself, so concurrent submits can't overshoot them
+        active = select(func.count()).select_from(models.Job).where(models.Job.status.in_(ACTIVE_STATUSES))
+        job_id = db.execute(
+            insert(models.Job)
+            .from_select(
+                ["user_id", "kind", "params_json", "status"],
+                select(literal(user_id), literal(kind), literal(json.dumps(params)), literal("queued")).where(
+                    active.where(models.Job.user_id == user_id).scalar_subquery() < JOBS_MAX_PER_USER,
+                    active.scalar_subquery() < JOBS_MAX_PENDING
+                )
+            )
+            .returning(models.Job.id)
+        ).scalar()
+
+        if job_id is None:
+            db.rollback()
+            if db.execute(active.where(models.Job.user_id == user_id)).scalar() >= JOBS_MAX_PER_USER:
+                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many active jobs for this user")
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Job queue is full, try again later")
+
+        job = db.get(models.Job, job_id)
+        commit_loaded(db, job)
+
+        self._dispatch(job.id)
+        return job
+
+    def cancel(self, db: Session, job_id: int, user_id: int) -> models.Job:
+        job = get_job(db, job_id, user_id)
+
+        if job.status == "queued":
+            # Never started: the worker will skip it when it fails to claim it
+            job.status = "cancelled"
+            job.finished_at = datetime.utcnow()
+        elif job.status == "running":
+            # Picked up by the handler at its next progress report
+            job.cancel_requested = True
+
+        commit_loaded(db, job)
+        return job
+
+    def _dispatch(self, job_id: int):
+        self.start()
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id: int):
+        with SessionLocal() as db:
+            claimed = db.execute(
+                update(models.Job)
+                .where(models.Job.id == job_id, models.Job.status == "queued")
+                .values(status="running", started_at=datetime.utcnow())
+            ).rowcount
+            db.commit()
+            if not claimed:
+                return  # Cancelled while queued, or claimed elsewhere
+
+            # Whatever goes wrong from here on (unknown kind, user gone, handler
+            # error) must end the job, or it would stay `running` and count
+            # against the user's cap until the next restart
+            try:
+                outcome = self._execute(db, job_id)
+            except JobCancelled:
+                outcome = {"status": "cancelled"}
+            except Exception as exc:
+                outcome = {"status": "failed", "error": str(exc) or exc.__class__.__name__}
+
+        self._finish(job_id, outcome)
+
+    def _execute(self, db: Session, job_id: int) -> dict:
+        job = db.get(models.Job, job_id)
+        user = db.get(models.User, job.user_id)
+        handler = JOB_HANDLERS[job.kind]
+        ctx = JobContext(job_id, job.user_id)
+
+        # Handlers work on the user's home shard (jobs themselves stay in the directory)
+        shard_session = get_shard_sessionmaker(user.shard)
+        shard_db = db if shard_session is SessionLocal else shard_session()
+        try:
+            if user.shard_moving:
+                raise UserDataMoving()
+            result = handler(shard_db, job.user_id, job.params, ctx)
+            return {"status": "succeeded", "result_json": json.dumps(result)}
+        except Exception:
+            shard_db.rollback()
+            raise
+        finally:
+            if shard_db is not db:
+                shard_db.close()
+
+    def _finish(self, job_id: int, outcome: dict):
+        # In a session of its own: the handler's may be unusable after an error
+        try:
+            with SessionLocal() as db:
+                db.execute(
+                    update(models.Job)
+                    .where(models.Job.id == job_id)
+                    .values(finished_at=datetime.utcnow(), **outcome)
+                )
+                db.commit()
+        except Exception:
+            logger.exception("Could not record the outcome of job %s", job_id)
+
+
+runner = JobRunner()
+
+
+def get_job(db: Session, job_id: int, user_id: int) -> models.Job:
+    job = db.query(models.Job).filter(models.Job.id == job_id, models.Job.user_id == user_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# -------------------------
+# Built-in handlers
+
+EXPORT_BATCH_SIZE = 1000
+
+def _export(db: Session, model, out_schema, user_id: int, ctx: JobContext):
+    query = db.query(model).filter(model.user_id == user_id)
+    total = query.count()
+    ctx.progress(0, total, force=True)
+
+    rows = []
+    for row in query.order_by(model.id).yield_per(EXPORT_BATCH_SIZE):
+        rows.append(out_schema.model_validate(row, from_attributes=True).model_dump())
+        if len(rows) % EXPORT_BATCH_SIZE == 0:
+            ctx.progress(len(rows))
+
+    ctx.progress(len(rows), force=True)
+    return rows
+
+
+@job_handler("export_books")
+def export_books(db: Session, user_id: int, params: dict, ctx: JobContext):
+    """
+    Result: every book of the user, as returned by GET /books/
+    """
+    return _export(db, models.Book, schemas.BookOut, user_id, ctx)
+
+
+@job_handler("export_tasks")
+def export_tasks(db: Session, user_id: int, params: dict, ctx: JobContext):
+    """
+    Result: every task of the user, as returned by GET /tasks/
+    """
+    return _export(db, models.Task, schemas.TaskOut, user_id, ctx)
+
+
+@job_handler("import_books")
+def import_books(db: Session, user_id: int, params: dict, ctx: JobContext):
+    """
+    params: {"books": [BookCreate, ...]}
+    Inserts in batches, committing each batch; a cancel keeps the batches already committed.
+    Result: number of imported books.
+    """
+    books = [schemas.BookCreate(**book) for book in params.get("books", [])]
+    ctx.progress(0, len(books), force=True)
+
+    for start in range(0, len(books), EXPORT_BATCH_SIZE):
+        ctx.checkpoint()
+        for book in books[start:start + EXPORT_BATCH_SIZE]:
+            db.add(crud.build_book(db, book, user_id))
+        db.commit()
+        ctx.progress(min(start + EXPORT_BATCH_SIZE, len(books)))
+
+    ctx.progress(len(books), force=True)
+    return {"imported": len(books)}
+
+
+def _archive_tasks(db: Session, user_id: int | None, stop=None, ctx: JobContext | None = None) -> int:
+    """
+    Archives aged completed tasks batch by batch, pausing between batches
+    so the archiver never holds locks for long or saturates the database.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=TASK_ARCHIVE_AFTER_DAYS)
+    moved = 0
+    while stop is None or not stop.is_set():
+        if ctx is not None:
+            ctx.checkpoint()
+        # The sweep leaves users being moved between shards alone: a batch
+        # committed during the copy could land a task there twice
+        skip_users = _moving_users() if user_id is None else ()
+        batch = crud.archive_completed_tasks(
+            db, cutoff, batch_size=TASK_ARCHIVE_BATCH_SIZE, user_id=user_id, skip_users=skip_users
+        )
+        moved += batch
+        if ctx is not None:
+            ctx.progress(moved, force=batch == 0)
+        if batch < TASK_ARCHIVE_BATCH_SIZE:
+            break
+        time.sleep(TASK_ARCHIVE_PAUSE_SECONDS)
+    return moved
+
+
+def _moving_users() -> list:
+    with SessionLocal() as directory:
+        return list(directory.scalars(select(models.User.id).where(models.User.shard_moving == True)))
+
+
+@job_handler("archive_tasks")
+def archive_tasks(db: Session, user_id: int, params: dict, ctx: JobContext):
+    """
+    On-demand archiving of the user's own aged completed tasks.
+    Result: number of archived tasks.
+    """
+    return {"archived": _archive_tasks(db, user_id, ctx=ctx)}
+
+
+class Archiver:
+    """
+    Periodic sweep moving aged completed tasks of all users, shard by shard, to tasks_archive.
+    Started/stopped from the app lifespan next to the job runner.
+    """
+
+    def __init__(self, interval: float = TASK_ARCHIVE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="task-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            for shard_session in list(shard_sessions.values()):
+                try:
+                    with shard_session() as db:
+                        _archive_tasks(db, user_id=None, stop=self._stop)
+                except Exception:
+                    logger.exception("Task archiving failed on a shard, retrying at the next sweep")
+
+
+archiver = Archiver()
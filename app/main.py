@@ -1,24 +1,49 @@
 # Importing internal modules
 import os
 from . import models                 # ORM models for tables
-from .database import engine, SessionLocal  # DB engine and session factory
+from .database import SessionLocal, shard_engines, get_shard_sessionmaker  # DB engines and session factories
 from . import schemas, crud         # Pydantic schemas and CRUD functions
 from sqlalchemy.orm import Session  # For dependency-injected DB session
-from fastapi import FastAPI, HTTPException, status, Depends  # Core FastAPI classes
+from fastapi import FastAPI, HTTPException, status, Depends, Query, Request, Response, Header  # Core FastAPI classes
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm  # Auth system
-from .auth import create_access_token, verify_token  # JWT handling
+from .auth import create_access_token, verify_token, is_admin_token  # JWT handling and admin token check
 from typing import List             # For typing response as list
 from .schemas import UserCreate, UserOut, TaskCreate, TaskOut, TaskUpdate  # Explicit schema imports
 from .crud import create_user, get_user_by_username, create_task  # Common CRUD functions
-from passlib.context import CryptContext  # For password hashing
+from . import hashing               # Shared password hashing policy
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from . import jobs                  # Background job runner
+from . import profiling             # Per-request profiling
+from . import querylog              # Slow query log with EXPLAIN capture
+from . import deadlines             # Request deadlines and cancellation
+from . import suggest               # Typeahead prefix index
+from . import groupcommit           # Opt-in batched commits for task writes
 
 
 # -------------------------
 # App and config setup
 
-app = FastAPI() 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick the password hashing cost for this host
+    hashing.configure_from_host()
+    # Start the background job pool and pick up jobs left over by a previous run
+    jobs.runner.start()
+    jobs.runner.recover()
+    jobs.archiver.start()
+    yield
+    groupcommit.committer.stop()
+    jobs.archiver.stop()
+    jobs.runner.shutdown()
+    if querylog.SLOW_QUERY_DUMP:
+        querylog.dump(querylog.SLOW_QUERY_DUMP)
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = profiling.ProfiledRoute  # Lets sync endpoints show up in request profiles
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(deadlines.DeadlineMiddleware)  # Outermost: the deadline covers the whole request
 
 
 # Mount the static directory
@@ -35,10 +60,9 @@ def read_index():
     with open(html_path, "r", encoding="utf-8") as f:
         return f.read()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")  # Password encryption context
-
-# Creates all tables if they don't exist (executed once at startup)
-models.Base.metadata.create_all(bind=engine)
+# Creates all tables if they don't exist (executed once at startup), on the directory and every shard
+for shard_engine in shard_engines.values():
+    models.Base.metadata.create_all(bind=shard_engine)
 
 
 # -------------------------
@@ -49,10 +73,19 @@ def root():
     return {"message": "ARG API Server is running!"}
 
 # -------------------------
-# Database session dependency
-
-def get_db():
-    db = SessionLocal()
+# Database session dependencies
+#
+# One session per database per request, shared by every dependency of the
+# request (FastAPI caches get_directory_db). A session checks out a
+# connection on its first query and returns it when its transaction ends;
+# request sessions don't expire on commit, so serializing what a write
+# returned doesn't check out a connection again (see commit_loaded).
+
+def get_directory_db():
+    """
+    Session on the directory database (users, jobs)
+    """
+    db = SessionLocal(expire_on_commit=False)
     try:
         yield db
     finally:
@@ -67,7 +100,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 # USER AUTH: Register & Login
 
 @app.post("/register", response_model=UserOut)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+def register(user: UserCreate, db: Session = Depends(get_directory_db)):
     """
     Register a new user with unique username
     """
@@ -78,21 +111,29 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     return new_user
 
 @app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_directory_db)):
     """
     Authenticate user and return access token
     """
     user = get_user_by_username(db, form_data.username)
-    if not user or not pwd_context.verify(form_data.password, user.hashed_password):
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
+    valid, new_hash = hashing.pwd_context.verify_and_update(form_data.password, user.hashed_password)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    if new_hash:
+        # Hash made with an outdated cost: upgrade it while we know the password
+        crud.update_password_hash(db, user, new_hash)
+
     token = create_access_token(data={"sub": str(user.id)})
     return {"access_token": token, "token_type": "bearer"}
 
 # -------------------------
 # User token validation
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+@profiling.profiled
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_directory_db)):
     """
     Validates token and returns the logged-in user
     """
@@ -105,6 +146,36 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+def get_db(
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+    directory_db: Session = Depends(get_directory_db)
+):
+    """
+    Session on the current user's home shard (books, tasks).
+    Shares the directory session when the home shard is the directory database.
+    """
+    if current_user.shard_moving and request.method not in ("GET", "HEAD"):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Your data is being moved, please retry shortly",
+            headers={"Retry-After": "5"}
+        )
+
+    shard_session = get_shard_sessionmaker(current_user.shard)
+    if shard_session is SessionLocal:
+        yield directory_db
+        return
+
+    # The directory is done with once the user is loaded: end the read so
+    # its connection isn't held while the request works on the shard
+    directory_db.commit()
+    db = shard_session(expire_on_commit=False)
+    try:
+        yield db
+    finally:
+        db.close()
+
 # -------------------------
 # BOOK ROUTES
 
@@ -124,6 +195,7 @@ def read_books(
     publisher: str = None,
     sort_by: str = "id",               # Sorting field
     sort_order: str = "asc",           # asc or desc
+    match: str = Query("contains", pattern="^(contains|exact)$"),  # How author/publisher are matched
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -134,9 +206,50 @@ def read_books(
         author=author,
         publisher=publisher,
         sort_by=sort_by,
-        sort_order=sort_order
+        sort_order=sort_order,
+        match=match
     )
 
+def conditional_changes(request: Request, response: Response, changes: dict):
+    """
+    Tags a delta sync page with its watermark as ETag and answers 304 when the
+    client already holds that watermark and nothing changed since.
+    """
+    etag = f'W/"{changes["watermark"]}"'
+    if not changes["changed"] and not changes["deleted"] and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return changes
+
+@app.get("/books/changes", response_model=schemas.BookChanges)
+def read_book_changes(
+    request: Request,
+    response: Response,
+    since: int = 0,                    # Watermark from the previous sync (0 = full sync)
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Delta sync: books created, updated or deleted after the `since` watermark
+    """
+    changes = crud.get_changes(db, models.Book, "book", current_user.id, since=since, limit=limit)
+    return conditional_changes(request, response, changes)
+
+@app.get("/books/suggest", response_model=List[str])
+def suggest_books(
+    field: str = Query(..., pattern="^(title|author|publisher)$"),
+    prefix: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Typeahead: distinct titles/authors/publishers of the user's books starting with `prefix`
+    (case-insensitive), in alphabetical order
+    """
+    return suggest.cache.suggest(db, current_user.id, field, prefix, limit)
+
 @app.delete("/books/{book_id}")
 def delete_book(
     book_id: int,
@@ -148,12 +261,27 @@ def delete_book(
 # -------------------------
 # TASK ROUTES (Main feature with user ownership)
 
+def run_grouped(db: Session, current_user: models.User, func):
+    """
+    Hands a task write to the group committer. The request's read is ended
+    first: a request holding its pooled connection while it waits would
+    starve the flusher of one once the pool is full of waiting writers.
+    """
+    db.commit()
+    return groupcommit.committer.run(current_user.shard, func)
+
 @app.post("/tasks/", response_model=TaskOut)
 def create_user_task(
     task: TaskCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    if groupcommit.GROUP_COMMIT:
+        # Serialised inside the batch: the row is only readable until the batch session closes
+        return run_grouped(
+            db, current_user,
+            lambda batch_db: TaskOut.model_validate(create_task(batch_db, task, current_user.id, commit=False))
+        )
     return create_task(db=db, task=task, user_id=current_user.id)
 
 @app.get("/tasks/", response_model=List[TaskOut])
@@ -164,9 +292,22 @@ def read_user_tasks(
     title: str = None,                    # filter by title keyword
     sort_by: str = "id",                  # sort field
     sort_order: str = "asc",              # asc or desc
+    include_archived: bool = False,       # also search archived (old completed) tasks
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    if include_archived:
+        return crud.get_tasks_including_archived(
+            db=db,
+            user_id=current_user.id,
+            completed=completed,
+            title=title,
+            sort_by=sort_by,
+            sort_order=sort_order,
+            skip=skip,
+            limit=limit
+        )
+
     query = db.query(models.Task).filter(models.Task.user_id == current_user.id)
 
     # Apply filters
@@ -191,22 +332,34 @@ def read_user_tasks(
         .all()
     )
 
+@app.get("/tasks/changes", response_model=schemas.TaskChanges)
+def read_task_changes(
+    request: Request,
+    response: Response,
+    since: int = 0,                    # Watermark from the previous sync (0 = full sync)
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Delta sync: tasks created, updated or deleted after the `since` watermark
+    """
+    changes = crud.get_changes(db, models.Task, "task", current_user.id, since=since, limit=limit)
+    return conditional_changes(request, response, changes)
+
 @app.post("/tasks/{task_id}/complete")
 def complete_task(
     task_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    task = db.query(models.Task).filter(
-        models.Task.id == task_id,
-        models.Task.user_id == current_user.id
-    ).first()
-    
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    task.completed = True
-    db.commit()
+    if groupcommit.GROUP_COMMIT:
+        run_grouped(
+            db, current_user,
+            lambda batch_db: crud.complete_task(batch_db, task_id, current_user.id, commit=False).id
+        )
+    else:
+        crud.complete_task(db, task_id, current_user.id)
     return {"message": "Task marked as completed"}
 
 @app.put("/tasks/{task_id}", response_model=TaskOut)
@@ -216,6 +369,13 @@ def update_user_task(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
+    if groupcommit.GROUP_COMMIT:
+        return run_grouped(
+            db, current_user,
+            lambda batch_db: TaskOut.model_validate(
+                crud.update_task(batch_db, task_id, current_user.id, task_update, commit=False)
+            )
+        )
     return crud.update_task(db=db, task_id=task_id, user_id=current_user.id, task_update=task_update)
 
 @app.delete("/tasks/{task_id}")
@@ -225,3 +385,86 @@ def delete_user_task(
     current_user: models.User = Depends(get_current_user)
 ):
     return crud.delete_task(db=db, task_id=task_id, user_id=current_user.id)
+
+# -------------------------
+# JOB ROUTES (background exports, imports and maintenance)
+
+@app.post("/jobs/", response_model=schemas.JobOut, status_code=202)
+def submit_job(
+    job: schemas.JobCreate,
+    db: Session = Depends(get_directory_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return jobs.runner.submit(db, user_id=current_user.id, kind=job.kind, params=job.params)
+
+@app.get("/jobs/{job_id}", response_model=schemas.JobOut)
+def read_job(
+    job_id: int,
+    db: Session = Depends(get_directory_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return jobs.get_job(db, job_id=job_id, user_id=current_user.id)
+
+@app.post("/jobs/{job_id}/cancel", response_model=schemas.JobOut)
+def cancel_job(
+    job_id: int,
+    db: Session = Depends(get_directory_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return jobs.runner.cancel(db, job_id=job_id, user_id=current_user.id)
+
+# -------------------------
+# ADMIN ROUTES (require the X-Admin-Token header, see auth.ADMIN_TOKEN)
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+def list_profiles():
+    """
+    Stored request profiles (newest first), without their stacks
+    """
+    return profiling.list_profiles()
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def read_profile(profile_id: str):
+    profile = profiling.load_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@app.get("/admin/profiles/{profile_id}/collapsed", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+def read_profile_collapsed(profile_id: str):
+    """
+    Profile as collapsed stacks, ready for flamegraph.pl or speedscope
+    """
+    profile = profiling.load_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profiling.collapsed_stacks(profile)
+
+@app.get("/admin/slow-queries", dependencies=[Depends(require_admin)])
+def read_slow_queries(min_count: int = 1):
+    """
+    Query fingerprints with count, total/mean/max time and the captured plan of slow ones
+    """
+    return {"threshold_ms": querylog.SLOW_QUERY_THRESHOLD_MS, "queries": querylog.report(min_count=min_count)}
+
+@app.delete("/admin/slow-queries", dependencies=[Depends(require_admin)])
+def reset_slow_queries():
+    querylog.reset()
+    return {"message": "Slow query log cleared"}
+
+@app.get("/admin/deadlines", dependencies=[Depends(require_admin)])
+def read_deadline_stats():
+    """
+    Requests answered 504 (timeouts), abandoned by their client (cancellations)
+    and queries interrupted on SQLite since startup
+    """
+    return {
+        "default_seconds": deadlines.REQUEST_DEADLINE_SECONDS,
+        "max_seconds": deadlines.REQUEST_DEADLINE_MAX_SECONDS,
+        "routes": deadlines.ROUTE_DEADLINES,
+        **deadlines.stats,
+    }
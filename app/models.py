@@ -1,7 +1,50 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+import json
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, BigInteger, Index, Text, DateTime, func, false, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.hybrid import hybrid_property
 from .database import Base
 from sqlalchemy.orm import relationship
 
+
+def normalize_name(value: str) -> str:
+    """
+    Catalog key of an author/publisher name: trimmed, inner whitespace
+    collapsed and case-folded, so "J.R.R.  Tolkien " == "j.r.r. tolkien"
+    """
+    return " ".join(value.split()).casefold()
+
+
+# Column type of normalize_name() keys. Prefix lookups scan them as ranges
+# (suggest.PREFIX_END), which needs code point order: SQLite's default
+# BINARY collation gives it, PostgreSQL needs the "C" collation
+NameKey = String().with_variant(postgresql.VARCHAR(collation="C"), "postgresql")
+
+
+def _title_key(context):
+    return normalize_name(context.get_current_parameters()["book_name"])
+
+# -------------------------
+# Author / Publisher catalog
+# Tables: authors, publishers
+# One row per distinct spelling, shared by every book on the shard; books
+# are found by the normalised name, and each keeps the spelling it was given
+
+class Author(Base):
+    __tablename__ = "authors"
+
+    id = Column(Integer, primary_key=True)
+    spelling = Column(String, nullable=False, unique=True)    # Exactly as entered
+    name = Column(NameKey, nullable=False, index=True)        # normalize_name() of the spelling
+
+
+class Publisher(Base):
+    __tablename__ = "publishers"
+
+    id = Column(Integer, primary_key=True)
+    spelling = Column(String, nullable=False, unique=True)    # Exactly as entered
+    name = Column(NameKey, nullable=False, index=True)        # normalize_name() of the spelling
+
 # -------------------------
 # Book Model
 # Table: books
@@ -11,15 +54,48 @@ class Book(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     book_name = Column(String, nullable=False)
+    title_key = Column(NameKey, nullable=False, default=_title_key)   # normalize_name() of book_name, for title prefix lookups
     description = Column(String, nullable=True)
     pages = Column(Integer, nullable=False)
-    author = Column(String, nullable=False)
-    publisher = Column(String, nullable=False)
+
+    # Catalog entries (see crud.catalog_id); loaded with the book in the same query
+    author_id = Column(Integer, ForeignKey("authors.id"), nullable=False)
+    publisher_id = Column(Integer, ForeignKey("publishers.id"), nullable=False)
+    author_entry = relationship("Author", lazy="joined", innerjoin=True)
+    publisher_entry = relationship("Publisher", lazy="joined", innerjoin=True)
 
     #New: Link book to user
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User")
 
+    # Change sequence for delta sync (GET /books/changes)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_books_user_id_change_seq", "user_id", "change_seq"),
+        Index("ix_books_user_id_author_id", "user_id", "author_id"),
+        Index("ix_books_user_id_publisher_id", "user_id", "publisher_id"),
+        Index("ix_books_user_id_title_key", "user_id", "title_key"),
+    )
+
+    # `author` / `publisher` keep the shape of BookOut; as SQL expressions
+    # they can be used for sorting (crud.get_books sort_by=author)
+    @hybrid_property
+    def author(self):
+        return self.author_entry.spelling
+
+    @author.expression
+    def author(cls):
+        return select(Author.spelling).where(Author.id == cls.author_id).scalar_subquery()
+
+    @hybrid_property
+    def publisher(self):
+        return self.publisher_entry.spelling
+
+    @publisher.expression
+    def publisher(cls):
+        return select(Publisher.spelling).where(Publisher.id == cls.publisher_id).scalar_subquery()
+
 # -------------------------
 # User Model
 # Table: users
@@ -30,6 +106,9 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)         # Hashed password (using bcrypt)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")  # Last change sequence handed out for this user's rows
+    shard = Column(String, nullable=True)                    # Home shard of the user's data (see database.py)
+    shard_moving = Column(Boolean, nullable=False, default=False, server_default=false())  # Writes refused while being rebalanced
 
     tasks = relationship("Task", back_populates="owner")
 
@@ -44,6 +123,90 @@ class Task(Base):
     title = Column(String, nullable=False)                    
     description = Column(String, nullable=True)               
     completed = Column(Boolean, default=False)                
+    completed_at = Column(DateTime, nullable=True)            # Set when the task is completed, drives archiving
 
     user_id = Column(Integer, ForeignKey("users.id"))         
     owner = relationship("User", back_populates="tasks")      
+
+    # Change sequence for delta sync (GET /tasks/changes)
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_tasks_user_id_change_seq", "user_id", "change_seq"),
+        Index("ix_tasks_completed_completed_at", "completed", "completed_at"),
+        # Ids are never reused on SQLite either: an archived task keeps its id in tasks_archive
+        {"sqlite_autoincrement": True},
+    )
+
+# -------------------------
+# Archived Task Model
+# Table: tasks_archive
+# Cold storage for old completed tasks, moved out of `tasks` by the archiver
+
+class TaskArchive(Base):
+    __tablename__ = "tasks_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # Same id the task had in `tasks`
+    title = Column(String, nullable=False)
+    description = Column(String, nullable=True)
+    completed = Column(Boolean, default=True)
+    completed_at = Column(DateTime, nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    archived_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_tasks_archive_user_id", "user_id"),
+    )
+
+# -------------------------
+# Tombstone Model
+# Table: tombstones
+# Records deleted books/tasks so delta sync clients can drop them locally
+
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String, nullable=False)                   # "book" or "task"
+    entity_id = Column(Integer, nullable=False)               # id of the deleted row
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    change_seq = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        Index("ix_tombstones_user_id_entity_change_seq", "user_id", "entity", "change_seq"),
+    )
+
+# -------------------------
+# Job Model
+# Table: jobs
+# Background jobs (exports, imports, maintenance) run by app/jobs.py
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String, nullable=False)                     # Registered handler name, e.g. "export_books"
+    status = Column(String, nullable=False, default="queued") # queued / running / succeeded / failed / cancelled
+    params_json = Column(Text, nullable=False, default="{}")
+    result_json = Column(Text, nullable=True)
+    error = Column(String, nullable=True)
+    progress_done = Column(Integer, nullable=False, default=0)
+    progress_total = Column(Integer, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_user_id_status", "user_id", "status"),
+        Index("ix_jobs_status", "status"),
+    )
+
+    @property
+    def params(self):
+        return json.loads(self.params_json or "{}")
+
+    @property
+    def result(self):
+        return json.loads(self.result_json) if self.result_json is not None else None
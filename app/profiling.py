@@ -0,0 +1,302 @@
+import functools
+import inspect
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+
+import anyio
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .auth import is_admin_token
+
+# -------------------------
+# Profiling configuration
+
+# Fraction of requests profiled without being asked (0 = only on X-Profile: 1)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+# Milliseconds between two stack samples
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+
+# Where profiles are written, and how many are kept (oldest are deleted first)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]+-[0-9a-f]{8}$")
+
+# Profile of the request being handled (propagates into threadpool workers)
+_current = ContextVar("profile_session", default=None)
+
+# Threads currently running code of a profiled request: thread id -> ProfileSession
+_threads = {}
+_threads_lock = threading.Lock()
+
+
+class ProfileSession:
+    """
+    Stack samples and metadata collected for one request
+    """
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.route = None
+        self.status = None
+        self.query_count = 0
+        self.samples = 0
+        self.stacks = Counter()
+        self.loop_thread = threading.get_ident()
+        self.anchor = None        # Middleware frame: marks event-loop work belonging to this request
+        self.started = time.perf_counter()
+        self.duration_ms = None
+
+    def record(self, frame, stop_code=None):
+        """
+        Adds one sample, walking up to the profiled call (worker threads) or to
+        this request's middleware frame (event loop). Stacks reaching neither
+        belong to something else and are dropped.
+        """
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            if frame.f_code is stop_code or frame is self.anchor:
+                break
+            frame = frame.f_back
+        else:
+            return
+        self.samples += 1
+        self.stacks[";".join(reversed(names))] += 1
+
+    def to_dict(self, with_stacks: bool = True) -> dict:
+        data = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "reason": self.reason,
+            "duration_ms": self.duration_ms,
+            "query_count": self.query_count,
+            "samples": self.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+        }
+        if with_stacks:
+            data["stacks"] = dict(self.stacks.most_common())
+        return data
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace("\\", "/").split("/")
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+# -------------------------
+# Sampler thread (only alive while at least one request is profiled)
+
+_sampler = None
+_sampler_lock = threading.Lock()
+_active_sessions = set()
+
+
+def _sample_forever():
+    global _sampler
+    interval = PROFILE_INTERVAL_MS / 1000
+    while True:
+        time.sleep(interval)
+        with _sampler_lock:
+            if not _active_sessions:
+                _sampler = None
+                return
+            sessions = list(_active_sessions)
+        with _threads_lock:
+            workers = dict(_threads)
+
+        frames = sys._current_frames()
+        for thread_id, session in workers.items():
+            frame = frames.get(thread_id)
+            if frame is not None:
+                session.record(frame, stop_code=_call_profiled.__code__)
+        for session in sessions:
+            frame = frames.get(session.loop_thread)
+            if frame is not None:
+                session.record(frame)
+
+
+def _start(session: ProfileSession):
+    global _sampler
+    with _sampler_lock:
+        _active_sessions.add(session)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_forever, name="profile-sampler", daemon=True)
+            _sampler.start()
+
+
+def _stop(session: ProfileSession):
+    with _sampler_lock:
+        _active_sessions.discard(session)
+
+# -------------------------
+# Hooks into request handling
+
+def _call_profiled(session, func, args, kwargs):
+    thread_id = threading.get_ident()
+    with _threads_lock:
+        _threads[thread_id] = session
+    try:
+        return func(*args, **kwargs)
+    finally:
+        with _threads_lock:
+            _threads.pop(thread_id, None)
+
+
+def profiled(func):
+    """
+    Marks a sync endpoint or dependency so its time in the threadpool shows up
+    in request profiles. Costs one ContextVar lookup when nobody is profiling.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _current.get()
+        if session is None:
+            return func(*args, **kwargs)
+        return _call_profiled(session, func, args, kwargs)
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Route class applying `profiled` to every sync endpoint
+    """
+
+    def get_route_handler(self):
+        call = self.dependant.call
+        if inspect.isfunction(call) and not (
+            inspect.iscoroutinefunction(call) or inspect.isgeneratorfunction(call)
+        ):
+            self.dependant.call = profiled(call)
+        return super().get_route_handler()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    session = _current.get()
+    if session is not None:
+        session.query_count += 1
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware profiling a request when it carries `X-Profile: 1`
+    together with a valid `X-Admin-Token`, or when picked by PROFILE_SAMPLE_RATE.
+    Unprofiled requests only pay for a header scan.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        reason = self._reason(scope)
+        if reason is None:
+            return await self.app(scope, receive, send)
+
+        session = ProfileSession(scope["method"], scope["path"], reason)
+        session.anchor = sys._getframe()
+        token = _current.set(session)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                session.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", session.id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        _start(session)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _stop(session)
+            _current.reset(token)
+            session.duration_ms = round((time.perf_counter() - session.started) * 1000, 3)
+            route = scope.get("route")
+            session.route = getattr(route, "path", None)
+            # Disk writes and rotation stay off the event loop; shielded so a
+            # cancelled request (deadline, disconnect) still leaves its profile
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(save_profile, session)
+
+    @staticmethod
+    def _reason(scope):
+        profile_header = admin_token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                profile_header = value
+            elif name == b"x-admin-token":
+                admin_token = value
+        if profile_header == b"1" and is_admin_token(admin_token and admin_token.decode()):
+            return "requested"
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return "sampled"
+        return None
+
+# -------------------------
+# On-disk store (rotating)
+
+def save_profile(session: ProfileSession):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f"{session.id}.json"), "w", encoding="utf-8") as f:
+        json.dump(session.to_dict(), f)
+
+    names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for name in names[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def load_profile(profile_id: str) -> dict | None:
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_profiles() -> list:
+    """
+    Metadata of stored profiles, newest first
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        data = load_profile(name[:-len(".json")]) if name.endswith(".json") else None
+        if data:
+            data.pop("stacks", None)
+            profiles.append(data)
+    return profiles
+
+
+def collapsed_stacks(profile: dict) -> str:
+    """
+    Profile in collapsed-stack format ("frame;frame;frame count"), as read by
+    flamegraph.pl and speedscope
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].items())
@@ -0,0 +1,176 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import deadlines
+
+# -------------------------
+# Slow query log configuration
+
+# Statements slower than this get their plan captured (once per fingerprint)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+
+# Upper bound on distinct fingerprints kept; later shapes are counted under "<other>"
+SLOW_QUERY_MAX_FINGERPRINTS = int(os.getenv("SLOW_QUERY_MAX_FINGERPRINTS", "5000"))
+
+# If set, the report is written to this JSON file when the app shuts down
+SLOW_QUERY_DUMP = os.getenv("SLOW_QUERY_DUMP")
+
+OTHER = "<other>"
+
+_stats = {}
+_lock = threading.Lock()
+
+# -------------------------
+# Fingerprinting
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r"%\(\w+\)s|\?|:\w+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """
+    Statement shape: literals and bound parameters become `?`, IN lists
+    collapse to `(?)` and whitespace is normalised, so the same query with
+    different values (or a different number of IN items) shares one entry.
+    """
+    shape = _STRING.sub("?", statement)
+    shape = _PARAM.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("(?)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+# -------------------------
+# Cursor hooks
+
+# The start time lives on the statement's execution context: a failing
+# statement (deadline interrupt, IntegrityError, ...) never reaches
+# after_cursor_execute, and nothing of it may stay on the pooled connection
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.querylog_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "querylog_start", None)
+    if started is None:
+        return
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    key = fingerprint(statement)
+    with _lock:
+        entry = _stats.get(key)
+        if entry is None:
+            if len(_stats) >= SLOW_QUERY_MAX_FINGERPRINTS:
+                key = OTHER
+                entry = _stats.get(key)
+            if entry is None:
+                entry = _stats[key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "slow_count": 0, "plan": None}
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+
+        slow = elapsed_ms >= SLOW_QUERY_THRESHOLD_MS
+        if slow:
+            entry["slow_count"] += 1
+        # Claim the plan slot under the lock so each fingerprint is explained at most once
+        explain = slow and entry["plan"] is None and key != OTHER and not executemany \
+            and statement.lstrip().upper().startswith("SELECT")
+        if explain:
+            entry["plan"] = []
+
+    if explain:
+        plan = _explain(conn.dialect.name, cursor, statement, parameters)
+        with _lock:
+            entry["plan"] = plan
+            entry["plan_ms"] = round(elapsed_ms, 3)
+
+
+def _explain(dialect: str, cursor, statement: str, parameters) -> list:
+    """
+    Runs EXPLAIN for a slow statement on the same DBAPI connection (and
+    transaction). Postgres re-executes it with ANALYZE, BUFFERS, except
+    inside a request (which has a deadline): there the plan is estimated
+    only, so the slow request doesn't pay for its query twice.
+    """
+    if dialect == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if deadlines.current_deadline.get() is None else "EXPLAIN "
+    elif dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+
+    # On Postgres a failing EXPLAIN (e.g. hit by statement_timeout) would
+    # abort the request's transaction: run it in a savepoint of its own
+    savepoint = dialect == "postgresql"
+    explain_cursor = cursor.connection.cursor()
+    try:
+        if savepoint:
+            explain_cursor.execute("SAVEPOINT querylog_explain")
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            rows = explain_cursor.fetchall()
+        except Exception as exc:
+            if savepoint:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT querylog_explain")
+            return [f"EXPLAIN failed: {exc}"]
+        if savepoint:
+            explain_cursor.execute("RELEASE SAVEPOINT querylog_explain")
+    finally:
+        explain_cursor.close()
+
+    if dialect == "sqlite":
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [" | ".join(str(col) for col in row) for row in rows]
+
+# -------------------------
+# Reporting
+
+def report(min_count: int = 1) -> list:
+    """
+    Statement fingerprints sorted by total time spent, slowest shapes first
+    """
+    with _lock:
+        items = [(key, dict(entry)) for key, entry in _stats.items()]
+    rows = []
+    for key, entry in items:
+        if entry["count"] < min_count:
+            continue
+        rows.append({
+            "fingerprint": key,
+            "count": entry["count"],
+            "total_ms": round(entry["total_ms"], 3),
+            "mean_ms": round(entry["total_ms"] / entry["count"], 3),
+            "max_ms": round(entry["max_ms"], 3),
+            "slow_count": entry["slow_count"],
+            "plan": entry["plan"],
+            "plan_ms": entry.get("plan_ms"),
+        })
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def dump(path: str):
+    """
+    Writes the report as JSON, e.g. to diff index work between two runs
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"threshold_ms": SLOW_QUERY_THRESHOLD_MS, "queries": report()}, f, indent=2)
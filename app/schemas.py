@@ -1,4 +1,6 @@
 from pydantic import BaseModel  # Used for defining data models with validation
+from typing import Any, List
+from datetime import datetime
 
 # -------------------------
 # Book Schemas (Optional / Legacy Feature)
@@ -76,7 +78,61 @@ class TaskOut(TaskBase):
     """
     id: int
     user_id: int  # To show ownership of task
+    completed_at: datetime | None = None
 
     model_config = {
         "from_attributes": True  # For ORM model to schema compatibility
     }
+
+# -------------------------
+# Delta Sync Schemas
+
+class BookChanges(BaseModel):
+    """
+    Schema for GET /books/changes
+    - changed: books created or updated after the watermark
+    - deleted: ids of books deleted after the watermark
+    - watermark: token to pass as `since` on the next call
+    """
+    changed: List[BookOut]
+    deleted: List[int]
+    watermark: int
+    has_more: bool
+
+class TaskChanges(BaseModel):
+    """
+    Schema for GET /tasks/changes (same shape as BookChanges)
+    """
+    changed: List[TaskOut]
+    deleted: List[int]
+    watermark: int
+    has_more: bool
+
+# -------------------------
+# Job Schemas
+
+class JobCreate(BaseModel):
+    """
+    Schema for submitting a background job (POST /jobs/)
+    """
+    kind: str
+    params: dict = {}
+
+class JobOut(BaseModel):
+    """
+    Schema for returning job state while polling (GET /jobs/{job_id})
+    """
+    id: int
+    kind: str
+    status: str
+    progress_done: int
+    progress_total: int | None = None
+    result: Any = None
+    error: str | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+    model_config = {
+        "from_attributes": True
+    }
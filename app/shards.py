@@ -0,0 +1,212 @@
+"""
+Shard tooling: user placement overview and online moves between shards.
+
+Usage:
+    python -m app.shards status
+    python -m app.shards move <user_id> <shard>
+"""
+import argparse
+import os
+import time
+
+from sqlalchemy import func, select, delete
+
+from . import models, crud
+from .database import SessionLocal, DEFAULT_SHARD, shard_sessions, get_shard_sessionmaker
+
+# Seconds to wait after flagging a user as moving, so writes that were already
+# past the check in get_db can commit on the source shard before the copy
+SHARD_MOVE_GRACE_SECONDS = float(os.getenv("SHARD_MOVE_GRACE_SECONDS", "2"))
+
+# Seconds to wait for the user's running jobs (they stop at their next batch
+# once the user is flagged) before the move is given up
+SHARD_MOVE_JOB_WAIT_SECONDS = float(os.getenv("SHARD_MOVE_JOB_WAIT_SECONDS", "60"))
+
+# Tables holding per-user data on a shard (order matters for deletes)
+USER_DATA_MODELS = [models.Tombstone, models.TaskArchive, models.Task, models.Book]
+
+
+def shard_status() -> dict:
+    """
+    Number of users per shard, from the directory
+    """
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(func.coalesce(models.User.shard, DEFAULT_SHARD), func.count())
+            .group_by(func.coalesce(models.User.shard, DEFAULT_SHARD))
+        ).all()
+    counts = {name: 0 for name in shard_sessions}
+    counts.update({name: count for name, count in rows})
+    return counts
+
+
+def move_user(user_id: int, target: str, grace: float = SHARD_MOVE_GRACE_SECONDS) -> dict:
+    """
+    Moves one user's books and tasks to another shard while the app keeps running.
+    - Reads keep being served from the source shard during the copy
+    - Writes get 503 + Retry-After until the directory points at the target
+    - Rows get new ids on the target; delta sync clients receive tombstones
+      for the old ids followed by the new rows, so their caches stay correct
+    - Jobs: queued ones fail when they start, running ones stop at their
+      next batch; the copy starts once none of the user's jobs is running.
+      The periodic archiver skips the user until the move is over
+    """
+    if target not in shard_sessions:
+        raise ValueError(f"Unknown shard '{target}'")
+
+    with SessionLocal() as directory:
+        user = directory.get(models.User, user_id)
+        if not user:
+            raise ValueError(f"User {user_id} not found")
+        source = user.shard or DEFAULT_SHARD
+        if source == target:
+            return {"books": 0, "tasks": 0}
+        user.shard_moving = True
+        directory.commit()
+
+    try:
+        time.sleep(grace)
+        _wait_for_running_jobs(user_id, SHARD_MOVE_JOB_WAIT_SECONDS)
+        counts = _copy_user_data(user_id, source, target)
+
+        with SessionLocal() as directory:
+            user = directory.get(models.User, user_id)
+            user.shard = target
+            user.shard_moving = False
+            directory.commit()
+    except Exception:
+        with SessionLocal() as directory:
+            directory.get(models.User, user_id).shard_moving = False
+            directory.commit()
+        raise
+
+    _purge_user_data(user_id, source)
+    return counts
+
+
+def _wait_for_running_jobs(user_id: int, timeout: float):
+    # A job still committing to the source shard after the copy would lose
+    # those rows when the source is purged
+    give_up_at = time.monotonic() + timeout
+    while True:
+        with SessionLocal() as directory:
+            running = directory.query(models.Job).filter(
+                models.Job.user_id == user_id, models.Job.status == "running"
+            ).count()
+        if not running:
+            return
+        if time.monotonic() >= give_up_at:
+            raise RuntimeError(f"User {user_id} still has {running} running job(s), move aborted")
+        time.sleep(0.2)
+
+
+def _copy_user_data(user_id: int, source: str, target: str) -> dict:
+    with get_shard_sessionmaker(source)() as src, get_shard_sessionmaker(target)() as dst:
+        source_user = src.get(models.User, user_id)
+
+        # The target counter must continue past every watermark a client may hold
+        target_user = dst.get(models.User, user_id)
+        if target_user is None:
+            dst.add(models.User(
+                id=user_id,
+                username=source_user.username,
+                hashed_password="!",
+                change_seq=source_user.change_seq
+            ))
+        else:
+            target_user.change_seq = max(target_user.change_seq, source_user.change_seq)
+        dst.flush()
+
+        books = src.query(models.Book).filter(models.Book.user_id == user_id).order_by(models.Book.id).all()
+        tasks = src.query(models.Task).filter(models.Task.user_id == user_id).order_by(models.Task.id).all()
+        archived = src.query(models.TaskArchive).filter(models.TaskArchive.user_id == user_id).order_by(models.TaskArchive.id).all()
+        tombstones = src.query(models.Tombstone).filter(models.Tombstone.user_id == user_id).order_by(models.Tombstone.change_seq).all()
+
+        # 1. Tombstones first: existing ones, then one per old id
+        old_ids = [(t.entity, t.entity_id) for t in tombstones]
+        old_ids += [("book", b.id) for b in books]
+        old_ids += [("task", t.id) for t in tasks + archived]
+        for entity, entity_id in old_ids:
+            dst.add(models.Tombstone(
+                entity=entity,
+                entity_id=entity_id,
+                user_id=user_id,
+                change_seq=crud.next_change_seq(dst, user_id)
+            ))
+
+        # 2. Then the rows themselves
+        for b in books:
+            dst.add(models.Book(
+                book_name=b.book_name,
+                description=b.description,
+                pages=b.pages,
+                author_id=crud.catalog_id(dst, models.Author, b.author),
+                publisher_id=crud.catalog_id(dst, models.Publisher, b.publisher),
+                user_id=user_id,
+                change_seq=crud.next_change_seq(dst, user_id)
+            ))
+        for t in tasks:
+            dst.add(models.Task(
+                title=t.title,
+                description=t.description,
+                completed=t.completed,
+                completed_at=t.completed_at,
+                user_id=user_id,
+                change_seq=crud.next_change_seq(dst, user_id)
+            ))
+
+        # 3. Archived tasks stay archived. Each takes a fresh id from `tasks`
+        #    (so it can't collide with a live task) and moves to the archive
+        #    in the same transaction, without ever showing up in delta sync
+        staged = [
+            models.Task(title=t.title, description=t.description, completed=t.completed,
+                        completed_at=t.completed_at, user_id=user_id)
+            for t in archived
+        ]
+        dst.add_all(staged)
+        dst.flush()
+        for new, t in zip(staged, archived):
+            dst.add(models.TaskArchive(
+                id=new.id,
+                title=t.title,
+                description=t.description,
+                completed=t.completed,
+                completed_at=t.completed_at,
+                user_id=user_id,
+                archived_at=t.archived_at
+            ))
+            dst.delete(new)
+
+        dst.commit()
+        return {"books": len(books), "tasks": len(tasks) + len(archived)}
+
+
+def _purge_user_data(user_id: int, shard: str):
+    with get_shard_sessionmaker(shard)() as db:
+        for model in USER_DATA_MODELS:
+            db.execute(delete(model).where(model.user_id == user_id))
+        # The directory keeps the real user row; other shards only had a mirror
+        if get_shard_sessionmaker(shard) is not SessionLocal:
+            db.execute(delete(models.User).where(models.User.id == user_id))
+        db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and rebalance user shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="number of users per shard")
+    move = commands.add_parser("move", help="move one user's data to another shard")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for name, count in shard_status().items():
+            print(f"{name}\t{count}")
+    else:
+        counts = move_user(args.user_id, args.shard)
+        print(f"moved user {args.user_id} to {args.shard}: {counts['books']} books, {counts['tasks']} tasks")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,12 @@ const logoutBtn = document.getElementById("logout");
 
 let mode = "login"; // or "register"
 
+// How often the local store is revalidated against /books/changes and /tasks/changes
+const REVALIDATE_INTERVAL_MS = 60000;
+
+// Pause in typing before the filter inputs ask /books/suggest
+const SUGGEST_DELAY_MS = 150;
+
 // Helpers
 function showAuth(show) {
   authSection.classList.toggle("hidden", !show);
@@ -51,9 +57,20 @@ function clearToken() {
   localStorage.removeItem("token");
 }
 
+// User id from the JWT payload ("sub"), used to keep one local cache per user
+function getUserId() {
+  const token = getToken();
+  if (!token) return null;
+  try {
+    return JSON.parse(atob(token.split(".")[1].replace(/-/g, "+").replace(/_/g, "/"))).sub;
+  } catch (e) {
+    return null;
+  }
+}
+
 // Generic API caller for JSON endpoints
 async function api(path, opts = {}) {
-  const headers = {};
+  const headers = { ...(opts.headers || {}) };
   if (path !== "/login") headers["Content-Type"] = "application/json";
   const token = getToken();
   if (token) headers["Authorization"] = `Bearer ${token}`;
@@ -64,6 +81,7 @@ async function api(path, opts = {}) {
   }
 
   const res = await fetch(path, { ...opts, headers, body });
+  if (res.status === 304) return null;
   if (!res.ok) {
     const text = await res.text();
     throw new Error(text || res.statusText);
@@ -71,7 +89,197 @@ async function api(path, opts = {}) {
   return res.status === 204 ? null : res.json();
 }
 
-//Auth 
+// Local store
+// Books and tasks are kept in memory (Map by id) and persisted to IndexedDB,
+// together with the delta sync watermark of each collection.
+
+const store = {
+  db: null,
+  books: new Map(),
+  tasks: new Map(),
+  meta: { books: { watermark: 0, complete: false }, tasks: { watermark: 0, complete: false } },
+};
+
+function idbRequest(req) {
+  return new Promise((resolve, reject) => {
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+
+async function openStore() {
+  store.books.clear();
+  store.tasks.clear();
+  store.meta = { books: { watermark: 0, complete: false }, tasks: { watermark: 0, complete: false } };
+  store.db = null;
+
+  const userId = getUserId();
+  if (!userId || !window.indexedDB) return;
+
+  try {
+    const open = indexedDB.open(`arg-cache-${userId}`, 1);
+    open.onupgradeneeded = () => {
+      open.result.createObjectStore("books", { keyPath: "id" });
+      open.result.createObjectStore("tasks", { keyPath: "id" });
+      open.result.createObjectStore("meta");
+    };
+    store.db = await idbRequest(open);
+
+    const tx = store.db.transaction(["books", "tasks", "meta"], "readonly");
+    const [books, tasks, booksMeta, tasksMeta] = await Promise.all([
+      idbRequest(tx.objectStore("books").getAll()),
+      idbRequest(tx.objectStore("tasks").getAll()),
+      idbRequest(tx.objectStore("meta").get("books")),
+      idbRequest(tx.objectStore("meta").get("tasks")),
+    ]);
+    for (const b of books) store.books.set(b.id, b);
+    for (const t of tasks) store.tasks.set(t.id, t);
+    if (booksMeta) store.meta.books = booksMeta;
+    if (tasksMeta) store.meta.tasks = tasksMeta;
+  } catch (e) {
+    // No persistence available (private mode, quota...): keep working in memory
+    store.db = null;
+  }
+}
+
+// Writes upserts/deletes (and optionally the collection meta) to IndexedDB
+function persist(collection, upserts = [], deletes = [], meta = null) {
+  if (!store.db) return;
+  const tx = store.db.transaction([collection, "meta"], "readwrite");
+  for (const item of upserts) tx.objectStore(collection).put(item);
+  for (const id of deletes) tx.objectStore(collection).delete(id);
+  if (meta) tx.objectStore("meta").put(meta, collection);
+}
+
+// Applies one delta sync page to the in-memory store, IndexedDB and the DOM
+function applyChanges(collection, changes) {
+  const items = store[collection];
+  for (const id of changes.deleted) items.delete(id);
+  for (const item of changes.changed) items.set(item.id, item);
+
+  store.meta[collection] = {
+    watermark: changes.watermark,
+    complete: store.meta[collection].complete || !changes.has_more,
+  };
+  persist(collection, changes.changed, changes.deleted, store.meta[collection]);
+
+  const view = views[collection];
+  for (const id of changes.deleted) view.remove(id);
+  for (const item of changes.changed) view.upsert(item);
+}
+
+// Pulls changes since the stored watermark; a 304 means nothing changed
+const syncing = {};
+async function sync(collection) {
+  if (syncing[collection]) return syncing[collection];
+  syncing[collection] = (async () => {
+    let hasMore = true;
+    while (hasMore) {
+      const watermark = store.meta[collection].watermark;
+      const changes = await api(`/${collection}/changes?since=${watermark}`, {
+        headers: { "If-None-Match": `W/"${watermark}"` },
+      });
+      if (!changes) {
+        store.meta[collection].complete = true;
+        break;
+      }
+      applyChanges(collection, changes);
+      hasMore = changes.has_more;
+    }
+  })().finally(() => {
+    syncing[collection] = null;
+  });
+  return syncing[collection];
+}
+
+function revalidate() {
+  if (!getToken()) return;
+  sync("books").catch(err => (bookError.textContent = err.message));
+  sync("tasks").catch(err => (taskError.textContent = err.message));
+}
+
+// List views
+// Each view keeps one DOM node per item and patches only the affected nodes.
+
+function createView(list, render, getFilters, matches) {
+  const nodes = new Map();
+  const ids = []; // Ids of `nodes` in ascending order, the default sort order of the API
+
+  // Index of the first id >= `id` (binary search)
+  function position(id) {
+    let lo = 0;
+    let hi = ids.length;
+    while (lo < hi) {
+      const mid = (lo + hi) >> 1;
+      if (ids[mid] < id) lo = mid + 1;
+      else hi = mid;
+    }
+    return lo;
+  }
+
+  function place(id, li) {
+    const at = position(id);
+    ids.splice(at, 0, id);
+    list.insertBefore(li, at + 1 < ids.length ? nodes.get(ids[at + 1]) : null);
+  }
+
+  function applyFilter(li, item) {
+    li.classList.toggle("hidden", !matches(item, getFilters()));
+  }
+
+  function build(item) {
+    const li = render(item);
+    li.dataset.id = item.id;
+    applyFilter(li, item);
+    return li;
+  }
+
+  return {
+    upsert(item) {
+      const old = nodes.get(item.id);
+      const li = build(item);
+      if (old) {
+        list.replaceChild(li, old);
+      } else {
+        place(item.id, li);
+      }
+      nodes.set(item.id, li);
+    },
+    remove(id) {
+      const li = nodes.get(id);
+      if (!li) return;
+      li.remove();
+      nodes.delete(id);
+      ids.splice(position(id), 1);
+    },
+    // Rebuilds the list from a set of items (initial render, server-side filtering)
+    reset(items) {
+      list.innerHTML = "";
+      nodes.clear();
+      ids.length = 0;
+      const fragment = document.createDocumentFragment();
+      for (const item of [...items].sort((a, b) => a.id - b.id)) {
+        const li = build(item);
+        fragment.appendChild(li);
+        nodes.set(item.id, li);
+        ids.push(item.id);
+      }
+      list.appendChild(fragment);
+    },
+    refilter(items) {
+      for (const [id, li] of nodes) {
+        const item = items.get(id);
+        if (item) applyFilter(li, item);
+      }
+    },
+  };
+}
+
+function contains(value, needle) {
+  return !needle || (value || "").toLowerCase().includes(needle.toLowerCase());
+}
+
+// Auth
 authForm.addEventListener("submit", async e => {
   e.preventDefault();
   authError.textContent = "";
@@ -92,8 +300,7 @@ authForm.addEventListener("submit", async e => {
       const { access_token } = await res.json();
       setToken(access_token);
       showAuth(false);
-      loadBooks();
-      loadTasks();
+      await start();
     } else {
       // register expects JSON
       await api("/register", {
@@ -119,7 +326,7 @@ toggleAuth.addEventListener("click", e => {
     mode === "login" ? "Register" : "Login";
 });
 
-//  Books 
+//  Books
 function getBookFilters() {
   return {
     name: nameFilter.value,
@@ -128,9 +335,58 @@ function getBookFilters() {
   };
 }
 
+function bookMatches(b, filters) {
+  return contains(b.book_name, filters.name) &&
+    contains(b.author, filters.author) &&
+    contains(b.publisher, filters.publisher);
+}
+
+function renderBook(b) {
+  const li = document.createElement("li");
+  const div = document.createElement("div");
+  const strong = document.createElement("strong");
+  strong.textContent = b.book_name;
+  const small = document.createElement("small");
+  small.textContent = `Publisher: ${b.publisher} | Pages: ${b.pages}`;
+  div.append(strong, ` by ${b.author}`, document.createElement("br"), small);
+  if (b.description) {
+    const p = document.createElement("p");
+    p.textContent = b.description;
+    div.appendChild(p);
+  }
+  li.appendChild(div);
+  if (b.pending) li.classList.add("pending");
+
+  const btn = document.createElement("button");
+  btn.textContent = "Delete";
+  btn.disabled = !!b.pending;
+  btn.onclick = () => deleteBook(b);
+  li.appendChild(btn);
+  return li;
+}
+
+async function deleteBook(b) {
+  bookError.textContent = "";
+  // Optimistic: drop the node now, put it back if the server refuses
+  store.books.delete(b.id);
+  bookView.remove(b.id);
+  try {
+    await api(`/books/${b.id}`, { method: "DELETE" });
+    persist("books", [], [b.id]);
+  } catch (e) {
+    store.books.set(b.id, b);
+    bookView.upsert(b);
+    bookError.textContent = e.message;
+  }
+}
+
+// Filters run locally once every book is cached, otherwise the server filters
 async function loadBooks(filters = {}) {
   bookError.textContent = "";
-  bookList.innerHTML = "";
+  if (store.meta.books.complete) {
+    bookView.refilter(store.books);
+    return;
+  }
   try {
     let url = "/books/";
     const params = new URLSearchParams();
@@ -139,30 +395,7 @@ async function loadBooks(filters = {}) {
     if (filters.publisher) params.append("publisher", filters.publisher);
     if (params.toString()) url += "?" + params.toString();
 
-    const books = await api(url);
-    for (const b of books) {
-      const li = document.createElement("li");
-      li.innerHTML = `
-        <div>
-          <strong>${b.book_name}</strong> by ${b.author}
-          <br>
-          <small>Publisher: ${b.publisher} | Pages: ${b.pages}</small>
-          ${b.description ? `<p>${b.description}</p>` : ''}
-        </div>
-      `;
-      const btn = document.createElement("button");
-      btn.textContent = "Delete";
-      btn.onclick = async () => {
-        try {
-          await api(`/books/${b.id}`, { method: "DELETE" });
-          loadBooks(getBookFilters());
-        } catch (e) {
-          bookError.textContent = e.message;
-        }
-      };
-      li.appendChild(btn);
-      bookList.appendChild(li);
-    }
+    bookView.reset(await api(url));
   } catch (err) {
     bookError.textContent = err.message;
   }
@@ -180,11 +413,19 @@ bookForm.addEventListener("submit", async e => {
     description: document.getElementById("description").value,
   };
 
+  // Optimistic: show the book under a temporary id until the server assigns one
+  const tempId = Number.MAX_SAFE_INTEGER - Date.now();
+  bookView.upsert({ ...book, id: tempId, pending: true });
+  bookForm.reset();
+
   try {
-    await api("/books/", { method: "POST", body: book });
-    bookForm.reset();
-    loadBooks(getBookFilters());
+    const created = await api("/books/", { method: "POST", body: book });
+    bookView.remove(tempId);
+    store.books.set(created.id, created);
+    persist("books", [created]);
+    bookView.upsert(created);
   } catch (err) {
+    bookView.remove(tempId);
     bookError.textContent = err.message;
   }
 });
@@ -201,24 +442,133 @@ clearBookFiltersBtn.addEventListener("click", () => {
   loadBooks();
 });
 
+// Typeahead for the book filters, served by GET /books/suggest
+function attachSuggestions(input, field, datalistId) {
+  const datalist = document.getElementById(datalistId);
+  let timer = null;
+  let latest = 0;
+
+  input.addEventListener("input", () => {
+    clearTimeout(timer);
+    const prefix = input.value.trim();
+    if (!prefix) {
+      datalist.replaceChildren();
+      return;
+    }
+    timer = setTimeout(async () => {
+      const request = ++latest;
+      try {
+        const params = new URLSearchParams({ field, prefix });
+        const values = await api(`/books/suggest?${params}`);
+        if (request !== latest) return; // A newer keystroke already asked
+        datalist.replaceChildren(...values.map(value => {
+          const option = document.createElement("option");
+          option.value = value;
+          return option;
+        }));
+      } catch (e) {
+        datalist.replaceChildren();
+      }
+    }, SUGGEST_DELAY_MS);
+  });
+}
+
+attachSuggestions(nameFilter, "title", "name-suggestions");
+attachSuggestions(authorFilter, "author", "author-suggestions");
+attachSuggestions(publisherFilter, "publisher", "publisher-suggestions");
+
 // Tasks
 function getTaskFilters() {
   const filters = {
     title: taskTitleFilter.value
   };
-  
+
   // Only add completed filter if a specific status is selected
   const status = taskStatusFilter.value;
   if (status === 'true' || status === 'false') {
     filters.completed = status === 'true';
   }
-  
+
   return filters;
 }
 
+function taskMatches(t, filters) {
+  return contains(t.title, filters.title) &&
+    (filters.completed === undefined || t.completed === filters.completed);
+}
+
+function renderTask(t) {
+  const li = document.createElement("li");
+  li.className = t.completed ? "task-completed" : "";
+  if (t.pending) li.classList.add("pending");
+
+  const h3 = document.createElement("h3");
+  h3.textContent = t.title;
+  li.appendChild(h3);
+  if (t.description) {
+    const p = document.createElement("p");
+    p.textContent = t.description;
+    li.appendChild(p);
+  }
+
+  const actions = document.createElement("div");
+  actions.className = "task-actions";
+
+  const completeBtn = document.createElement("button");
+  completeBtn.className = "complete-task";
+  completeBtn.textContent = t.completed ? "Completed" : "Complete";
+  completeBtn.disabled = !!t.pending;
+  completeBtn.onclick = () => completeTask(t);
+
+  const deleteBtn = document.createElement("button");
+  deleteBtn.className = "delete-task";
+  deleteBtn.textContent = "Delete";
+  deleteBtn.disabled = !!t.pending;
+  deleteBtn.onclick = () => deleteTask(t);
+
+  actions.append(completeBtn, deleteBtn);
+  li.appendChild(actions);
+  return li;
+}
+
+async function completeTask(t) {
+  taskError.textContent = "";
+  if (t.completed) return;
+  // Optimistic: flip the node now, revert if the server refuses
+  const done = { ...t, completed: true };
+  store.tasks.set(t.id, done);
+  taskView.upsert(done);
+  try {
+    await api(`/tasks/${t.id}/complete`, { method: "POST" });
+    persist("tasks", [done]);
+  } catch (e) {
+    store.tasks.set(t.id, t);
+    taskView.upsert(t);
+    taskError.textContent = e.message;
+  }
+}
+
+async function deleteTask(t) {
+  taskError.textContent = "";
+  store.tasks.delete(t.id);
+  taskView.remove(t.id);
+  try {
+    await api(`/tasks/${t.id}`, { method: "DELETE" });
+    persist("tasks", [], [t.id]);
+  } catch (e) {
+    store.tasks.set(t.id, t);
+    taskView.upsert(t);
+    taskError.textContent = e.message;
+  }
+}
+
+// Filters run locally once every task is cached, otherwise the server filters
 async function loadTasks(filters = {}) {
   taskError.textContent = "";
-  taskList.innerHTML = "";
+  if (store.meta.tasks.complete) {
+    taskView.refilter(store.tasks);
+    return;
+  }
   try {
     let url = "/tasks/";
     const params = new URLSearchParams();
@@ -226,44 +576,7 @@ async function loadTasks(filters = {}) {
     if (filters.completed !== undefined) params.append("completed", filters.completed);
     if (params.toString()) url += "?" + params.toString();
 
-    const tasks = await api(url);
-    for (const t of tasks) {
-      const li = document.createElement("li");
-      li.className = t.completed ? "task-completed" : "";
-      
-      li.innerHTML = `
-        <h3>${t.title}</h3>
-        ${t.description ? `<p>${t.description}</p>` : ''}
-        <div class="task-actions">
-          <button class="complete-task" data-id="${t.id}">
-            ${t.completed ? "Completed" : "Complete"}
-          </button>
-          <button class="delete-task" data-id="${t.id}">Delete</button>
-        </div>
-      `;
-
-      const completeBtn = li.querySelector(".complete-task");
-      completeBtn.onclick = async () => {
-        try {
-          await api(`/tasks/${t.id}/complete`, { method: "POST" });
-          loadTasks(getTaskFilters());
-        } catch (e) {
-          taskError.textContent = e.message;
-        }
-      };
-
-      const deleteBtn = li.querySelector(".delete-task");
-      deleteBtn.onclick = async () => {
-        try {
-          await api(`/tasks/${t.id}`, { method: "DELETE" });
-          loadTasks(getTaskFilters());
-        } catch (e) {
-          taskError.textContent = e.message;
-        }
-      };
-
-      taskList.appendChild(li);
-    }
+    taskView.reset(await api(url));
   } catch (err) {
     taskError.textContent = err.message;
   }
@@ -279,11 +592,18 @@ taskForm.addEventListener("submit", async e => {
     completed: false
   };
 
+  const tempId = Number.MAX_SAFE_INTEGER - Date.now();
+  taskView.upsert({ ...task, id: tempId, pending: true });
+  taskForm.reset();
+
   try {
-    await api("/tasks/", { method: "POST", body: task });
-    taskForm.reset();
-    loadTasks(getTaskFilters());
+    const created = await api("/tasks/", { method: "POST", body: task });
+    taskView.remove(tempId);
+    store.tasks.set(created.id, created);
+    persist("tasks", [created]);
+    taskView.upsert(created);
   } catch (err) {
+    taskView.remove(tempId);
     taskError.textContent = err.message;
   }
 });
@@ -299,17 +619,38 @@ clearTaskFiltersBtn.addEventListener("click", () => {
   loadTasks();
 });
 
-// Logout 
+const bookView = createView(bookList, renderBook, getBookFilters, bookMatches);
+const taskView = createView(taskList, renderTask, getTaskFilters, taskMatches);
+const views = { books: bookView, tasks: taskView };
+
+// Render whatever is cached right away, then catch up in the background
+async function start() {
+  await openStore();
+  bookView.reset([...store.books.values()]);
+  taskView.reset([...store.tasks.values()]);
+  revalidate();
+}
+
+// Revalidate when the tab becomes visible again and on a slow timer
+document.addEventListener("visibilitychange", () => {
+  if (document.visibilityState === "visible") revalidate();
+});
+setInterval(revalidate, REVALIDATE_INTERVAL_MS);
+
+// Logout
 logoutBtn.addEventListener("click", () => {
   clearToken();
+  if (store.db) store.db.close();
+  store.db = null;
+  bookView.reset([]);
+  taskView.reset([]);
   showAuth(true);
 });
 
 // Init
 if (getToken()) {
   showAuth(false);
-  loadBooks();
-  loadTasks();
+  start();
 } else {
   showAuth(true);
 }
@@ -0,0 +1,216 @@
+import bisect
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from . import models
+
+# -------------------------
+# Typeahead configuration
+
+# Users whose prefix index is kept in memory (least recently used are evicted)
+SUGGEST_MAX_USERS = int(os.getenv("SUGGEST_MAX_USERS", "1000"))
+
+# Users with more books than this are always answered from the database
+SUGGEST_MAX_BOOKS = int(os.getenv("SUGGEST_MAX_BOOKS", "20000"))
+
+# Field name in GET /books/suggest -> Book attribute
+FIELDS = {"title": "book_name", "author": "author", "publisher": "publisher"}
+
+# Sorts after every character, so [prefix, prefix + PREFIX_END) is a prefix range
+PREFIX_END = "\U0010ffff"
+
+# Cache entry of users answered from the database
+TOO_LARGE = object()
+
+
+class SortedValues:
+    """
+    Distinct values of one field, as a sorted array of normalised keys with
+    the number of books using each key and its display spelling
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.counts = {}
+        self.display = {}
+
+    def add(self, value: str):
+        key = models.normalize_name(value)
+        if key in self.counts:
+            self.counts[key] += 1
+        else:
+            self.counts[key] = 1
+            self.display[key] = value
+            bisect.insort(self.keys, key)
+
+    def remove(self, value: str):
+        key = models.normalize_name(value)
+        self.counts[key] -= 1
+        if self.counts[key] == 0:
+            del self.counts[key], self.display[key]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def prefixed(self, prefix: str, limit: int) -> list:
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + PREFIX_END, start, min(len(self.keys), start + limit))
+        return [self.display[key] for key in self.keys[start:end]]
+
+
+class UserIndex:
+    """
+    Prefix index over one user's books, current up to change sequence `seq`
+    """
+
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.books = {}                   # book id -> (title, author, publisher)
+        self.fields = {field: SortedValues() for field in FIELDS}
+
+    def put(self, book_id: int, values: tuple):
+        self.drop(book_id)
+        self.books[book_id] = values
+        for field, value in zip(FIELDS, values):
+            self.fields[field].add(value)
+
+    def drop(self, book_id: int):
+        values = self.books.pop(book_id, None)
+        if values is not None:
+            for field, value in zip(FIELDS, values):
+                self.fields[field].remove(value)
+
+
+def _values(book: models.Book) -> tuple:
+    return tuple(getattr(book, attr) for attr in FIELDS.values())
+
+
+class SuggestCache:
+    """
+    Per-user prefix indexes, built on first use and kept current by the
+    crud write paths. Writes made elsewhere (other workers, jobs, shard
+    moves) are caught up from the delta sync stream before answering.
+    """
+
+    def __init__(self, max_users: int = SUGGEST_MAX_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def suggest(self, db: Session, user_id: int, field: str, prefix: str, limit: int = 10) -> list:
+        prefix = models.normalize_name(prefix)
+        index = self._fresh_index(db, user_id)
+        if index is None:
+            return suggest_from_db(db, user_id, field, prefix, limit)
+        with self._lock:
+            return index.fields[field].prefixed(prefix, limit)
+
+    def book_written(self, user_id: int, book: models.Book):
+        with self._lock:
+            index = self._users.get(user_id)
+            if isinstance(index, UserIndex):
+                index.put(book.id, _values(book))
+                if book.change_seq == index.seq + 1:
+                    index.seq = book.change_seq
+
+    def book_deleted(self, user_id: int, book_id: int, change_seq: int):
+        with self._lock:
+            index = self._users.get(user_id)
+            if isinstance(index, UserIndex):
+                index.drop(book_id)
+                if change_seq == index.seq + 1:
+                    index.seq = change_seq
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def _fresh_index(self, db: Session, user_id: int):
+        """
+        The user's index brought up to date, or None when the user has too
+        many books to be kept in memory
+        """
+        # Every change hands out a sequence number <= the counter and commits
+        # before the counter can be read past it, so replaying the changes
+        # after index.seq brings the index up to `current`
+        current = db.execute(select(models.User.change_seq).where(models.User.id == user_id)).scalar() or 0
+        with self._lock:
+            index = self._users.get(user_id)
+            if user_id in self._users:
+                self._users.move_to_end(user_id)
+        if index is TOO_LARGE:
+            return None
+        if index is None:
+            return self._build(db, user_id, current)
+        if index.seq < current:
+            self._catch_up(db, user_id, index, current)
+        return index
+
+    def _catch_up(self, db: Session, user_id: int, index: UserIndex, current: int):
+        from . import crud
+        since = index.seq
+        while True:
+            changes = crud.get_changes(db, models.Book, "book", user_id, since=since, limit=1000)
+            with self._lock:
+                for book_id in changes["deleted"]:
+                    index.drop(book_id)
+                for book in changes["changed"]:
+                    index.put(book.id, _values(book))
+            since = changes["watermark"]
+            if not changes["has_more"]:
+                break
+        with self._lock:
+            index.seq = max(index.seq, current)
+
+    def _build(self, db: Session, user_id: int, current: int):
+        books = (
+            db.query(models.Book)
+            .filter(models.Book.user_id == user_id)
+            .limit(SUGGEST_MAX_BOOKS + 1)
+            .all()
+        )
+        index = UserIndex(current)
+        for book in books[:SUGGEST_MAX_BOOKS]:
+            index.put(book.id, _values(book))
+        with self._lock:
+            # Oversized users are remembered too, so they are not re-read on every keystroke
+            self._users[user_id] = TOO_LARGE if len(books) > SUGGEST_MAX_BOOKS else index
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return None if len(books) > SUGGEST_MAX_BOOKS else index
+
+
+def suggest_from_db(db: Session, user_id: int, field: str, prefix: str, limit: int = 10) -> list:
+    """
+    Fallback for users without an in-memory index: a range scan on the
+    normalised catalog name (authors/publishers) or on the
+    (user_id, title_key) index (titles), keyed like the in-memory index
+    """
+    if field == "title":
+        title_key = models.Book.title_key
+        rows = db.execute(
+            select(func.min(models.Book.book_name))
+            .where(models.Book.user_id == user_id, title_key >= prefix, title_key < prefix + PREFIX_END)
+            .group_by(title_key)
+            .order_by(title_key)
+            .limit(limit)
+        )
+        return [row[0] for row in rows]
+
+    model, column = (models.Author, models.Book.author_id) if field == "author" else (models.Publisher, models.Book.publisher_id)
+    # The range scan runs on the catalog key; the suggestion is one of the user's own spellings
+    rows = db.execute(
+        select(func.min(model.spelling))
+        .select_from(models.Book)
+        .join(model, model.id == column)
+        .where(models.Book.user_id == user_id, model.name >= prefix, model.name < prefix + PREFIX_END)
+        .group_by(model.name)
+        .order_by(model.name)
+        .limit(limit)
+    )
+    return [row[0] for row in rows]
+
+
+cache = SuggestCache()
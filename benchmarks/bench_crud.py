@@ -0,0 +1,191 @@
+"""
+Benchmark: CRUD functions across data scale tiers.
+
+For every tier the database is rebuilt with benchmarks/datagen.py, then each
+case is timed for three users picked from the Zipf distribution: the
+heaviest ("head"), a median one and the lightest ("tail"). Results are
+written as JSON so two runs can be compared.
+
+Usage:
+    DATABASE_URL=sqlite:///bench.db python benchmarks/bench_crud.py run --tiers tiny,small --out base.json
+    ... change something ...
+    DATABASE_URL=sqlite:///bench.db python benchmarks/bench_crud.py run --tiers tiny,small --out new.json
+    python benchmarks/bench_crud.py compare base.json new.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_crud.db")
+
+# Datasets per tier; the head user gets roughly 1/8 of the rows
+TIERS = {
+    "tiny": {"users": 10, "books": 100, "tasks": 100},
+    "small": {"users": 1_000, "books": 100_000, "tasks": 100_000},
+    "large": {"users": 10_000, "books": 1_000_000, "tasks": 1_000_000},
+    "huge": {"users": 100_000, "books": 10_000_000, "tasks": 10_000_000},
+}
+
+# Differences below this many milliseconds are noise, whatever the ratio
+NOISE_FLOOR_MS = 0.5
+
+
+def build_cases(db, user):
+    """
+    Callables to time for one user, keyed by case name
+    """
+    from app import crud, models, schemas
+    from app.main import read_user_tasks
+
+    sample_book = db.query(models.Book).filter(models.Book.user_id == user.id).first()
+    author = sample_book.author if sample_book else "nobody"
+    task_count = db.query(models.Task).filter(models.Task.user_id == user.id).count()
+    middle_task = (
+        db.query(models.Task.id).filter(models.Task.user_id == user.id)
+        .order_by(models.Task.id).offset(task_count // 2).limit(1).scalar()
+    )
+    toggle = {"completed": False}
+
+    def update_task():
+        toggle["completed"] = not toggle["completed"]
+        crud.update_task(db, middle_task, user.id, schemas.TaskUpdate(completed=toggle["completed"]))
+
+    cases = {
+        "get_books": lambda: crud.get_books(db, user.id),
+        "get_books_by_author": lambda: crud.get_books(db, user.id, author=author),
+        "get_books_by_author_exact": lambda: crud.get_books(db, user.id, author=author, match="exact"),
+        "get_books_sorted_by_name": lambda: crud.get_books(db, user.id, sort_by="book_name", sort_order="desc"),
+        "get_tasks_for_user": lambda: crud.get_tasks_for_user(db, user.id),
+        "get_tasks_for_user_deep_page": lambda: crud.get_tasks_for_user(db, user.id, skip=task_count // 2),
+        "read_user_tasks_filtered": lambda: read_user_tasks(
+            skip=0, limit=10, completed=False, title="report", sort_by="title", sort_order="asc",
+            include_archived=False, db=db, current_user=user
+        ),
+    }
+    if middle_task is not None:
+        cases["update_task"] = update_task
+    return cases
+
+
+def time_case(func, repeat: int, warmup: int = 2) -> dict:
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "n": repeat,
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def run(args):
+    import sqlalchemy
+    import datagen
+    from app import models
+    from app.database import Base, SessionLocal, engine
+
+    report = {
+        "meta": {
+            "started": datetime.utcnow().isoformat(timespec="seconds"),
+            "dialect": engine.dialect.name,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "tiers": {},
+        "results": [],
+    }
+
+    for tier in args.tiers.split(","):
+        size = TIERS[tier]
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        loaded = datagen.generate(engine, size["users"], size["books"], size["tasks"], seed=args.seed)
+        report["tiers"][tier] = {key: loaded[key] for key in ("users", "books", "tasks", "seconds")}
+        print(f"[{tier}] loaded {loaded['books']} books, {loaded['tasks']} tasks for {loaded['users']} users in {loaded['seconds']}s")
+
+        for profile, info in loaded["profiles"].items():
+            with SessionLocal() as db:
+                user = db.get(models.User, info["user_id"])
+                for case, func in build_cases(db, user).items():
+                    result = time_case(func, args.repeat)
+                    report["results"].append({
+                        "tier": tier, "profile": profile, "case": case,
+                        "books": info["books"], "tasks": info["tasks"], **result
+                    })
+                    print(f"  {profile:<7}{case:<30}p50 {result['p50_ms']:>10.3f} ms  p95 {result['p95_ms']:>10.3f} ms")
+
+    if not args.keep:
+        Base.metadata.drop_all(bind=engine)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+
+
+def compare(args) -> int:
+    """
+    Prints p50 changes between two reports; exit status 1 if any case got
+    slower by more than --threshold (relative) and NOISE_FLOOR_MS (absolute)
+    """
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    key = lambda row: (row["tier"], row["profile"], row["case"])
+    base_rows = {key(row): row for row in base["results"]}
+    regressions = 0
+
+    print(f"{'tier':<7}{'profile':<8}{'case':<30}{'base p50':>12}{'new p50':>12}{'ratio':>8}")
+    for row in new["results"]:
+        old = base_rows.get(key(row))
+        if old is None:
+            continue
+        ratio = row["p50_ms"] / old["p50_ms"] if old["p50_ms"] else float("inf")
+        regressed = ratio > 1 + args.threshold and row["p50_ms"] - old["p50_ms"] > NOISE_FLOOR_MS
+        regressions += regressed
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{row['tier']:<7}{row['profile']:<8}{row['case']:<30}{old['p50_ms']:>12.3f}{row['p50_ms']:>12.3f}{ratio:>8.2f}{flag}")
+
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="load each tier and time the CRUD cases")
+    run_parser.add_argument("--tiers", default="tiny,small", help=f"comma separated, from {', '.join(TIERS)}")
+    run_parser.add_argument("--repeat", type=int, default=20)
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--out", default="bench_crud.json")
+    run_parser.add_argument("--keep", action="store_true", help="keep the last tier's data afterwards")
+
+    compare_parser = commands.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown of p50")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Benchmark: task writes with one commit per request vs group commit.
+
+Concurrent writers create and complete tasks for a set of users, first with
+the regular crud calls (one transaction each), then through
+app.groupcommit (one transaction per batch). With --http both modes also
+run through the API routes (POST /tasks/, POST /tasks/{id}/complete), so
+authentication and the request's own session share the pool with the
+flusher; commits/s then includes the requests' read transactions.
+Reports writes/s, commits/s and write latency percentiles.
+
+Usage:
+    DATABASE_URL=sqlite:///bench.db python benchmarks/bench_group_commit.py --writers 32 --writes 200 --http
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_group_commit.db")
+os.environ.setdefault("PASSWORD_HASH_ROUNDS", "4")
+
+from sqlalchemy import event
+
+from app import auth, crud, groupcommit, models, schemas
+from app.database import Base, SessionLocal, engine
+
+
+def direct_write(user_id: int, i: int):
+    with SessionLocal() as db:
+        task = crud.create_task(db, schemas.TaskCreate(title=f"task {i}"), user_id)
+        if i % 2:
+            crud.complete_task(db, task.id, user_id)
+
+
+def grouped_write(committer, user_id: int, i: int):
+    task_id = committer.run(
+        None, lambda db: crud.create_task(db, schemas.TaskCreate(title=f"task {i}"), user_id, commit=False).id
+    )
+    if i % 2:
+        committer.run(None, lambda db: crud.complete_task(db, task_id, user_id, commit=False).id)
+
+
+def http_write(client, headers: dict, i: int):
+    r = client.post("/tasks/", json={"title": f"task {i}"}, headers=headers)
+    r.raise_for_status()
+    if i % 2:
+        client.post(f"/tasks/{r.json()['id']}/complete", headers=headers).raise_for_status()
+
+
+def measure(write, writers: int, writes: int, users: list) -> dict:
+    commits = [0]
+    count_commit = lambda conn: commits.__setitem__(0, commits[0] + 1)
+    event.listen(engine, "commit", count_commit)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def writer(n: int):
+        for i in range(writes):
+            start = time.perf_counter()
+            write(users[(n + i) % len(users)], i)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        list(pool.map(writer, range(writers)))
+    seconds = time.perf_counter() - start
+    event.remove(engine, "commit", count_commit)
+
+    latencies.sort()
+    return {
+        "requests_per_s": len(latencies) / seconds,
+        "commits_per_s": commits[0] / seconds,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=32, help="concurrent writer threads")
+    parser.add_argument("--writes", type=int, default=200, help="requests per writer")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--window-ms", type=float, default=groupcommit.GROUP_COMMIT_WINDOW_MS)
+    parser.add_argument("--max-batch", type=int, default=groupcommit.GROUP_COMMIT_MAX_BATCH)
+    parser.add_argument("--http", action="store_true", help="also run both modes through the API routes")
+    args = parser.parse_args()
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        users = [models.User(username=f"writer{i}", hashed_password="!") for i in range(args.users)]
+        db.add_all(users)
+        db.commit()
+        user_ids = [user.id for user in users]
+
+    results = {"per-request commit": measure(direct_write, args.writers, args.writes, user_ids)}
+
+    committer = groupcommit.GroupCommitter(window_ms=args.window_ms, max_batch=args.max_batch)
+    try:
+        results["group commit"] = measure(
+            lambda user_id, i: grouped_write(committer, user_id, i), args.writers, args.writes, user_ids
+        )
+    finally:
+        committer.stop()
+
+    if args.http:
+        from fastapi.testclient import TestClient
+        from app.main import app
+
+        client = TestClient(app)
+        headers = {
+            user_id: {"Authorization": f"Bearer {auth.create_access_token(data={'sub': str(user_id)})}"}
+            for user_id in user_ids
+        }
+        http = lambda user_id, i: http_write(client, headers[user_id], i)
+        results["per-request commit (HTTP)"] = measure(http, args.writers, args.writes, user_ids)
+
+        grouped = groupcommit.GroupCommitter(window_ms=args.window_ms, max_batch=args.max_batch)
+        groupcommit.GROUP_COMMIT, groupcommit.committer = True, grouped
+        try:
+            results["group commit (HTTP)"] = measure(http, args.writers, args.writes, user_ids)
+        finally:
+            grouped.stop()
+
+    print(f"{engine.dialect.name}, {args.writers} writers x {args.writes} requests "
+          f"(window {args.window_ms} ms, max batch {args.max_batch})")
+    print(f"{'mode':<29}{'requests/s':>12}{'commits/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<29}{r['requests_per_s']:>12.0f}{r['commits_per_s']:>12.0f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+    print(f"group commit: {committer.stats['writes']} writes in {committer.stats['batches']} batches")
+
+    Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
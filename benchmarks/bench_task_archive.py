@@ -0,0 +1,113 @@
+"""
+Benchmark: GET /tasks/ latency for a heavy user before and after archiving.
+
+Loads one user with many tasks (most of them completed long ago), times a
+few list queries through the API, archives the aged completed tasks and
+times the same queries again.
+
+Usage:
+    DATABASE_URL=sqlite:///bench.db python benchmarks/bench_task_archive.py --tasks 200000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("DATABASE_URL", "sqlite:///bench_task_archive.db")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from app import crud, models
+from app.database import Base, SessionLocal, engine
+from app.main import app
+
+QUERIES = {
+    "first_page": "/tasks/",
+    "open_tasks": "/tasks/?completed=false",
+    "title_search": "/tasks/?title=report",
+    "sorted_by_title": "/tasks/?sort_by=title&sort_order=desc",
+}
+
+
+def load(client, tasks: int, completed_ratio: float):
+    client.post("/register", json={"username": "heavy", "password": "pw"})
+    token = client.post("/login", data={"username": "heavy", "password": "pw"}).json()["access_token"]
+
+    with SessionLocal() as db:
+        user = crud.get_user_by_username(db, "heavy")
+        aged = datetime.utcnow() - timedelta(days=365)
+        rows = []
+        for i in range(tasks):
+            done = i < tasks * completed_ratio
+            rows.append({
+                "title": f"{'report' if i % 50 == 0 else 'task'} {i}",
+                "description": "x" * 40,
+                "completed": done,
+                "completed_at": aged if done else None,
+                "user_id": user.id,
+                "change_seq": i + 1,
+            })
+            if len(rows) == 10000:
+                db.execute(insert(models.Task), rows)
+                rows = []
+        if rows:
+            db.execute(insert(models.Task), rows)
+        db.commit()
+
+    return {"Authorization": f"Bearer {token}"}
+
+
+def measure(client, headers, repeat: int):
+    results = {}
+    for name, url in QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            r = client.get(url, headers=headers)
+            timings.append((time.perf_counter() - start) * 1000)
+            assert r.status_code == 200, r.text
+        results[name] = (statistics.median(timings), max(timings))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--completed-ratio", type=float, default=0.9)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    client = TestClient(app)
+    headers = load(client, args.tasks, args.completed_ratio)
+
+    before = measure(client, headers, args.repeat)
+
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        moved = 0
+        cutoff = datetime.utcnow() - timedelta(days=30)
+        while True:
+            batch = crud.archive_completed_tasks(db, cutoff, batch_size=5000)
+            moved += batch
+            if batch == 0:
+                break
+    archive_seconds = time.perf_counter() - start
+
+    after = measure(client, headers, args.repeat)
+
+    print(f"tasks={args.tasks} archived={moved} in {archive_seconds:.1f}s")
+    print(f"{'query':<18}{'before p50':>12}{'after p50':>12}{'before max':>12}{'after max':>12}  (ms)")
+    for name in QUERIES:
+        print(f"{name:<18}{before[name][0]:>12.2f}{after[name][0]:>12.2f}{before[name][1]:>12.2f}{after[name][1]:>12.2f}")
+
+    Base.metadata.drop_all(bind=engine)
+
+
+if __name__ == "__main__":
+    main()
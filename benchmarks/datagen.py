@@ -0,0 +1,262 @@
+"""
+Synthetic data generator: bulk-loads users, books and tasks with skewed,
+realistic distributions for benchmarking.
+
+- Rows per user follow a Zipf law (a few heavy users own most rows)
+- Titles/descriptions have log-normal lengths
+- Authors and publishers come from fixed-size catalog pools with Zipf popularity
+- Deterministic for a given --seed
+
+Loading uses COPY on PostgreSQL and batched executemany elsewhere, in a
+single transaction per table.
+
+Usage:
+    DATABASE_URL=sqlite:///bench.db python benchmarks/datagen.py --users 1000 --books 100000 --tasks 100000
+"""
+import argparse
+import csv
+import io
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import insert, select, func
+
+from app import models
+from app.hashing import pwd_context
+
+BATCH_SIZE = 10000
+
+WORDS = (
+    "time year people way day man thing woman life child world school state family student group "
+    "country problem hand part place case week company system program question work government number "
+    "night point home water room mother area money story fact month lot right study book eye job word "
+    "business issue side kind head house service friend father power hour game line end member law car "
+    "city community name president team minute idea kid body information back parent face others level "
+    "office door health person art war history party result change morning reason research girl guy "
+    "moment air teacher force education report"
+).split()
+
+
+def zipf_counts(total: int, n: int, s: float) -> list:
+    """
+    Splits `total` rows over `n` ranks with weight 1/rank**s (rank 1 first).
+    Exact: the counts add up to `total`; leftover rows go to the head.
+    """
+    weights = [1 / (rank ** s) for rank in range(1, n + 1)]
+    norm = sum(weights)
+    counts = [int(total * w / norm) for w in weights]
+    for i in range(total - sum(counts)):
+        counts[i % n] += 1
+    return counts
+
+
+def zipf_picker(rng: random.Random, size: int, s: float):
+    """
+    Returns a function drawing an index below `size` with Zipf popularity
+    """
+    population = range(size)
+    cum_weights = list(itertools.accumulate(1 / (rank ** s) for rank in range(1, size + 1)))
+    return lambda: rng.choices(population, cum_weights=cum_weights)[0]
+
+
+def text_of_length(rng: random.Random, median: float, sigma: float, cap: int) -> str:
+    """
+    Words from WORDS up to a log-normally distributed number of characters
+    """
+    target = min(cap, max(1, int(rng.lognormvariate(math.log(median), sigma))))
+    words, length = [], 0
+    while length < target:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:target]
+
+
+def name_pool(rng: random.Random, size: int, words: int) -> list:
+    return [" ".join(rng.choice(WORDS).capitalize() for _ in range(words)) + f" {i}" for i in range(size)]
+
+
+class Generator:
+    """
+    Builds the rows of one dataset. Rows are generated lazily so datasets far
+    larger than memory can be streamed into the database.
+    """
+
+    def __init__(self, users: int, books: int, tasks: int, authors: int = 5000, publishers: int = 200,
+                 user_skew: float = 1.1, author_skew: float = 1.05, completed_ratio: float = 0.6,
+                 seed: int = 42):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.books_per_user = zipf_counts(books, users, user_skew)
+        self.tasks_per_user = zipf_counts(tasks, users, user_skew)
+        self.authors = name_pool(self.rng, authors, 2)
+        self.publishers = name_pool(self.rng, publishers, 1)
+        self.pick_author = zipf_picker(self.rng, authors, author_skew)
+        self.pick_publisher = zipf_picker(self.rng, publishers, author_skew)
+        self.completed_ratio = completed_ratio
+        self.now = datetime.utcnow()
+
+    def user_rows(self, first_id: int, password_hash: str):
+        for rank in range(self.users):
+            yield {
+                "id": first_id + rank,
+                "username": f"user{rank:07d}",
+                "hashed_password": password_hash,
+                "change_seq": self.books_per_user[rank] + self.tasks_per_user[rank],
+            }
+
+    def book_rows(self, first_id: int, author_ids: list, publisher_ids: list):
+        rng = self.rng
+        for rank, count in enumerate(self.books_per_user):
+            for seq in range(1, count + 1):
+                title = text_of_length(rng, 24, 0.5, 200)
+                yield {
+                    "book_name": title,
+                    "title_key": models.normalize_name(title),
+                    "description": text_of_length(rng, 200, 1.0, 4000),
+                    "pages": int(rng.lognormvariate(math.log(280), 0.5)) + 1,
+                    "author_id": author_ids[self.pick_author()],
+                    "publisher_id": publisher_ids[self.pick_publisher()],
+                    "user_id": first_id + rank,
+                    "change_seq": seq,
+                }
+
+    def task_rows(self, first_id: int):
+        rng = self.rng
+        for rank, count in enumerate(self.tasks_per_user):
+            offset = self.books_per_user[rank]  # change_seq continues after the user's books
+            for seq in range(1, count + 1):
+                done = rng.random() < self.completed_ratio
+                yield {
+                    "title": ("report " if rng.random() < 0.02 else "") + text_of_length(rng, 30, 0.6, 200),
+                    "description": text_of_length(rng, 80, 1.0, 2000),
+                    "completed": done,
+                    "completed_at": self.now - timedelta(minutes=rng.randrange(0, 60 * 24 * 365)) if done else None,
+                    "user_id": first_id + rank,
+                    "change_seq": offset + seq,
+                }
+
+# -------------------------
+# Bulk loading
+
+def _batches(rows, size: int = BATCH_SIZE):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_load(connection, table, rows) -> int:
+    """
+    Inserts rows (dicts with the same keys) into `table` on an open connection.
+    PostgreSQL gets COPY ... FROM STDIN, other backends executemany.
+    """
+    loaded = 0
+    for batch in _batches(rows):
+        if connection.dialect.name == "postgresql":
+            columns = list(batch[0])
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in batch:
+                writer.writerow(["" if row[c] is None else row[c] for c in columns])
+            buffer.seek(0)
+            cursor = connection.connection.dbapi_connection.cursor()
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+                buffer
+            )
+        else:
+            connection.execute(insert(table), batch)
+        loaded += len(batch)
+    return loaded
+
+
+def load_catalog(connection, model, names: list) -> list:
+    """
+    Makes sure every spelling has a catalog row (models.Author / models.Publisher)
+    and returns their ids, in the order of `names`
+    """
+    existing = dict(connection.execute(select(model.spelling, model.id)).all())
+    missing = {name for name in names if name not in existing}
+    bulk_load(connection, model.__table__, ({"spelling": name, "name": models.normalize_name(name)} for name in sorted(missing)))
+    if missing:
+        existing = dict(connection.execute(select(model.spelling, model.id)).all())
+    return [existing[name] for name in names]
+
+
+def generate(engine, users: int, books: int, tasks: int, **options) -> dict:
+    """
+    Loads a dataset into the (already created) schema behind `engine`.
+    Returns row counts, load time and the ids of the head/median/tail users.
+    """
+    gen = Generator(users, books, tasks, **options)
+    password_hash = pwd_context.hash("password")  # One hash shared by every generated user
+
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        first_id = (connection.execute(select(func.max(models.User.id))).scalar() or 0) + 1
+        bulk_load(connection, models.User.__table__, gen.user_rows(first_id, password_hash))
+        author_ids = load_catalog(connection, models.Author, gen.authors)
+        publisher_ids = load_catalog(connection, models.Publisher, gen.publishers)
+        loaded_books = bulk_load(connection, models.Book.__table__, gen.book_rows(first_id, author_ids, publisher_ids))
+        loaded_tasks = bulk_load(connection, models.Task.__table__, gen.task_rows(first_id))
+        if connection.dialect.name == "postgresql":
+            for table in ("users", "authors", "publishers", "books", "tasks"):
+                connection.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+                )
+                connection.exec_driver_sql(f"ANALYZE {table}")
+        else:
+            connection.exec_driver_sql("ANALYZE")
+
+    return {
+        "users": users,
+        "books": loaded_books,
+        "tasks": loaded_tasks,
+        "seconds": round(time.perf_counter() - start, 3),
+        # Rank 0 is the heaviest user; the median and last ranks show typical and tiny users
+        "profiles": {
+            "head": {"user_id": first_id, "books": gen.books_per_user[0], "tasks": gen.tasks_per_user[0]},
+            "median": {"user_id": first_id + users // 2, "books": gen.books_per_user[users // 2], "tasks": gen.tasks_per_user[users // 2]},
+            "tail": {"user_id": first_id + users - 1, "books": gen.books_per_user[-1], "tasks": gen.tasks_per_user[-1]},
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--authors", type=int, default=5000, help="distinct authors (publishers scale with it)")
+    parser.add_argument("--user-skew", type=float, default=1.1, help="Zipf exponent of rows per user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first")
+    args = parser.parse_args()
+
+    from app.database import Base, engine
+
+    if args.reset:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    summary = generate(
+        engine, args.users, args.books, args.tasks,
+        authors=args.authors, publishers=max(1, args.authors // 25),
+        user_skew=args.user_skew, seed=args.seed
+    )
+    print(f"loaded {summary['users']} users, {summary['books']} books, {summary['tasks']} tasks in {summary['seconds']}s")
+    for name, profile in summary["profiles"].items():
+        print(f"  {name:<7} user {profile['user_id']}: {profile['books']} books, {profile['tasks']} tasks")
+
+
+if __name__ == "__main__":
+    main()
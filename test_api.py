@@ -95,6 +95,90 @@ def test_get_books_with_filter():
     xs = [b["author"] for b in r.json()]
     assert xs == ["Alice"]
 
+def test_books_share_normalised_author_catalog():
+    from app import models
+    from app.database import SessionLocal
+
+    client.post("/register", json={"username": "fred", "password": "pw"})
+    token = client.post("/login", data={"username": "fred", "password": "pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+
+    for name, author in [("A", "Ursula Le Guin"), ("B", "  ursula  LE GUIN "), ("C", "Ursula Le Guinness")]:
+        client.post("/books/", json={"book_name": name, "pages": 1, "author": author, "publisher": "Ace"}, headers=hdr)
+
+    # One catalog entry per spelling, found through the normalised name
+    with SessionLocal() as db:
+        assert db.query(models.Author).count() == 3
+        assert db.query(models.Author.name).distinct().count() == 2
+        assert db.query(models.Publisher).count() == 1
+
+    # Exact match ignores case and spacing; each book keeps its own spelling
+    r = client.get("/books/?author=URSULA LE GUIN&match=exact", headers=hdr)
+    assert [(b["book_name"], b["author"]) for b in r.json()] == [("A", "Ursula Le Guin"), ("B", "  ursula  LE GUIN ")]
+
+    r = client.get("/books/?author=le guin&sort_by=author&sort_order=desc", headers=hdr)
+    assert [b["book_name"] for b in r.json()][0] == "C"
+
+    assert client.get("/books/?author=Nobody&match=exact", headers=hdr).json() == []
+
+def test_catalog_spelling_does_not_leak_between_users(monkeypatch):
+    from app import suggest
+
+    headers = []
+    for username in ("hana", "hugo"):
+        client.post("/register", json={"username": username, "password": "pw"})
+        token = client.post("/login", data={"username": username, "password": "pw"}).json()["access_token"]
+        headers.append({"Authorization": f"Bearer {token}"})
+    hana, hugo = headers
+
+    client.post("/books/", json={"book_name": "Kindred", "pages": 1, "author": "OCTAVIA BUTLER", "publisher": "BEACON"}, headers=hana)
+    r = client.post("/books/", json={"book_name": "Dawn", "pages": 1, "author": "Octavia Butler", "publisher": "Beacon"}, headers=hugo)
+    assert (r.json()["author"], r.json()["publisher"]) == ("Octavia Butler", "Beacon")
+
+    books = client.get("/books/?author=octavia butler&match=exact", headers=hugo).json()
+    assert [(b["author"], b["publisher"]) for b in books] == [("Octavia Butler", "Beacon")]
+
+    monkeypatch.setattr(suggest, "SUGGEST_MAX_BOOKS", 0)
+    suggest.cache.clear()
+    assert client.get("/books/suggest?field=author&prefix=oct", headers=hugo).json() == ["Octavia Butler"]
+    assert client.get("/books/suggest?field=publisher&prefix=b", headers=hana).json() == ["BEACON"]
+
+def test_suggest_prefixes_from_memory_and_db(monkeypatch):
+    from app import suggest
+
+    suggest.cache.clear()
+    client.post("/register", json={"username": "gina", "password": "pw"})
+    token = client.post("/login", data={"username": "gina", "password": "pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+
+    ids = {}
+    for name, author in [("Dune", "Frank Herbert"), ("Emma", "Jane Austen"), ("Persuasion", "jane austen"), ("Jaws", "Peter Benchley")]:
+        r = client.post("/books/", json={"book_name": name, "pages": 1, "author": author, "publisher": "Pan"}, headers=hdr)
+        ids[name] = r.json()["id"]
+
+    def suggestions(field, prefix):
+        return client.get(f"/books/suggest?field={field}&prefix={prefix}", headers=hdr).json()
+
+    assert suggestions("author", "JA") == ["Jane Austen"]
+    assert suggestions("title", "p") == ["Persuasion"]
+
+    # Write paths keep the warm index current
+    client.delete(f"/books/{ids['Persuasion']}", headers=hdr)
+    client.post("/books/", json={"book_name": "Jane Eyre", "pages": 1, "author": "Charlotte Bronte", "publisher": "Pan"}, headers=hdr)
+    assert suggestions("title", "j") == ["Jane Eyre", "Jaws"]
+    assert suggestions("publisher", "x") == []
+
+    # Users over the memory limit are answered by the database, with the same keys
+    for name in ("Émile", "Straße der Wölfe", "The  Hobbit"):
+        client.post("/books/", json={"book_name": name, "pages": 1, "author": "Anon", "publisher": "Pan"}, headers=hdr)
+    cases = [("author", "ja"), ("title", "j"), ("title", "é"), ("title", "strasse"), ("title", "the h"), ("title", "THE  HOB")]
+    from_memory = [suggestions(field, prefix) for field, prefix in cases]
+    monkeypatch.setattr(suggest, "SUGGEST_MAX_BOOKS", 0)
+    suggest.cache.clear()
+    assert [suggestions(field, prefix) for field, prefix in cases] == from_memory == [
+        ["Jane Austen"], ["Jane Eyre", "Jaws"], ["Émile"], ["Straße der Wölfe"], ["The  Hobbit"], ["The  Hobbit"]
+    ]
+
 # ── Delete Book ────────────────────────────────────────────
 
 def test_delete_book_unauthenticated():
@@ -127,3 +211,667 @@ def test_delete_book_success():
     # verify gone
     r2 = client.get("/books/", headers=hdr)
     assert all(b["id"] != bid for b in r2.json())
+
+# ── Delta sync ─────────────────────────────────────────────
+
+def test_book_and_task_changes_since_watermark():
+    client.post("/register", json={"username": "hana", "password": "pw"})
+    token = client.post("/login", data={"username": "hana","password":"pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+
+    b1 = client.post("/books/", json={
+        "book_name":"Old", "description":"", "pages":1, "author":"A","publisher":"P"
+    }, headers=hdr).json()
+    t1 = client.post("/tasks/", json={"title": "first"}, headers=hdr).json()
+
+    # full sync
+    r = client.get("/books/changes", headers=hdr).json()
+    assert [b["id"] for b in r["changed"]] == [b1["id"]]
+    assert r["deleted"] == [] and r["has_more"] is False
+    book_mark = r["watermark"]
+    task_mark = client.get("/tasks/changes", headers=hdr).json()["watermark"]
+
+    # nothing changed since the watermark
+    r = client.get(f"/books/changes?since={book_mark}", headers=hdr).json()
+    assert r["changed"] == [] and r["deleted"] == [] and r["watermark"] == book_mark
+
+    # one insert, one delete, one update
+    b2 = client.post("/books/", json={
+        "book_name":"New", "description":"", "pages":2, "author":"B","publisher":"P"
+    }, headers=hdr).json()
+    client.delete(f"/books/{b1['id']}", headers=hdr)
+    client.post(f"/tasks/{t1['id']}/complete", headers=hdr)
+
+    r = client.get(f"/books/changes?since={book_mark}", headers=hdr).json()
+    assert [b["id"] for b in r["changed"]] == [b2["id"]]
+    assert r["deleted"] == [b1["id"]]
+    assert r["watermark"] > book_mark
+
+    r = client.get(f"/tasks/changes?since={task_mark}", headers=hdr).json()
+    assert [t["completed"] for t in r["changed"]] == [True]
+
+    # paging: limit cuts the page and reports has_more
+    r = client.get(f"/books/changes?since={book_mark}&limit=1", headers=hdr).json()
+    assert r["has_more"] is True and len(r["changed"]) + len(r["deleted"]) == 1
+
+def test_changes_conditional_request():
+    client.post("/register", json={"username": "kate", "password": "pw"})
+    token = client.post("/login", data={"username": "kate","password":"pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+    client.post("/tasks/", json={"title": "t"}, headers=hdr)
+
+    r = client.get("/tasks/changes", headers=hdr)
+    etag, mark = r.headers["etag"], r.json()["watermark"]
+    assert etag == f'W/"{mark}"'
+
+    r = client.get(f"/tasks/changes?since={mark}", headers={**hdr, "If-None-Match": etag})
+    assert r.status_code == 304
+
+def test_changes_committed_between_lookups_are_not_skipped():
+    from sqlalchemy import event
+    from app import crud, models
+    from app.database import SessionLocal
+
+    client.post("/register", json={"username": "kurt", "password": "pw"})
+    token = client.post("/login", data={"username": "kurt", "password": "pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+    kept, gone = (client.post("/tasks/", json={"title": t}, headers=hdr).json()["id"] for t in ("kept", "gone"))
+    since = client.get("/tasks/changes", headers=hdr).json()["watermark"]
+    user_id = _user_id("kurt")
+
+    # An update (seq N) and a delete (seq N+1) commit after the rows lookup
+    # but before the tombstones lookup
+    def write_in_between(state):
+        if "tombstones" in str(state.statement) and not written:
+            written.append(True)
+            client.put(f"/tasks/{kept}", json={"title": "renamed"}, headers=hdr)
+            client.delete(f"/tasks/{gone}", headers=hdr)
+
+    written = []
+    with SessionLocal() as db:
+        event.listen(db, "do_orm_execute", write_in_between)
+        pages = [crud.get_changes(db, models.Task, "task", user_id, since=since)]
+    # Keep syncing from the returned watermark, as a client would
+    while pages[-1]["changed"] or pages[-1]["deleted"] or len(pages) == 1:
+        with SessionLocal() as db:
+            pages.append(crud.get_changes(db, models.Task, "task", user_id, since=pages[-1]["watermark"]))
+    changed = [task.id for page in pages for task in page["changed"]]
+    deleted = [task_id for page in pages for task_id in page["deleted"]]
+
+    assert written and changed == [kept] and deleted == [gone]
+
+# ── Background jobs ────────────────────────────────────────
+
+def test_export_job_submit_and_poll():
+    import time
+
+    client.post("/register", json={"username": "ivan", "password": "pw"})
+    token = client.post("/login", data={"username": "ivan","password":"pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+    for name in ("A", "B"):
+        client.post("/books/", json={
+            "book_name": name, "description":"", "pages":1, "author":"X","publisher":"Y"
+        }, headers=hdr)
+
+    r = client.post("/jobs/", json={"kind": "export_books"}, headers=hdr)
+    assert r.status_code == 202
+    job_id = r.json()["id"]
+
+    for _ in range(100):
+        job = client.get(f"/jobs/{job_id}", headers=hdr).json()
+        if job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+
+    assert job["status"] == "succeeded"
+    assert [b["book_name"] for b in job["result"]] == ["A", "B"]
+    assert job["progress_done"] == job["progress_total"] == 2
+
+def test_unknown_job_kind():
+    client.post("/register", json={"username": "jill", "password": "pw"})
+    token = client.post("/login", data={"username": "jill","password":"pw"}).json()["access_token"]
+    r = client.post("/jobs/", json={"kind": "nope"}, headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 400
+
+def test_job_failing_outside_its_handler_is_marked_failed():
+    from app import jobs, models
+    from app.database import SessionLocal
+
+    client.post("/register", json={"username": "kurt", "password": "pw"})
+    with SessionLocal() as db:
+        # Claimable, but its kind has no handler (e.g. removed since it was queued)
+        job = models.Job(user_id=_user_id("kurt"), kind="retired_kind", status="queued")
+        db.add(job)
+        db.commit()
+        job_id = job.id
+
+    jobs.runner._run(job_id)
+    with SessionLocal() as db:
+        job = db.get(models.Job, job_id)
+        assert job.status == "failed" and "retired_kind" in job.error and job.finished_at is not None
+
+def test_job_cap_holds_under_concurrent_submits(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from fastapi import HTTPException
+    from app import jobs
+    from app.database import SessionLocal
+
+    client.post("/register", json={"username": "lena", "password": "pw"})
+    user_id = _user_id("lena")
+    monkeypatch.setattr(jobs, "JOBS_MAX_PER_USER", 2)
+    monkeypatch.setattr(jobs.runner, "_dispatch", lambda job_id: None)  # Jobs stay queued
+
+    def submit(_):
+        with SessionLocal() as db:
+            try:
+                return jobs.runner.submit(db, user_id, "export_books", {}).id
+            except HTTPException as exc:
+                return exc.status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(submit, range(8)))
+    assert results.count(429) == 6
+
+# ── Task archive ───────────────────────────────────────────
+
+def test_archived_tasks_listed_with_include_archived():
+    from datetime import datetime, timedelta
+    from app import crud
+    from app.database import SessionLocal
+
+    client.post("/register", json={"username": "liam", "password": "pw"})
+    token = client.post("/login", data={"username": "liam","password":"pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+
+    old = client.post("/tasks/", json={"title": "old done"}, headers=hdr).json()
+    client.post("/tasks/", json={"title": "open"}, headers=hdr)
+    r = client.post(f"/tasks/{old['id']}/complete", headers=hdr)
+    assert r.status_code == 200
+
+    with SessionLocal() as db:
+        moved = crud.archive_completed_tasks(db, datetime.utcnow() + timedelta(seconds=1))
+    assert moved == 1
+
+    titles = [t["title"] for t in client.get("/tasks/", headers=hdr).json()]
+    assert titles == ["open"]
+
+    r = client.get("/tasks/?include_archived=true&sort_by=title", headers=hdr).json()
+    assert [t["title"] for t in r] == ["old done", "open"]
+    assert r[0]["id"] == old["id"] and r[0]["completed_at"] is not None
+
+    r = client.get("/tasks/?include_archived=true&completed=false", headers=hdr).json()
+    assert [t["title"] for t in r] == ["open"]
+
+def test_archived_task_ids_are_not_reused_and_leave_tombstones():
+    from datetime import datetime, timedelta
+    from app import crud
+    from app.database import SessionLocal
+
+    client.post("/register", json={"username": "mona", "password": "pw"})
+    token = client.post("/login", data={"username": "mona","password":"pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+
+    newest = client.post("/tasks/", json={"title": "newest"}, headers=hdr).json()
+    client.post(f"/tasks/{newest['id']}/complete", headers=hdr)
+    watermark = client.get("/tasks/changes", headers=hdr).json()["watermark"]
+    with SessionLocal() as db:
+        assert crud.archive_completed_tasks(db, datetime.utcnow() + timedelta(seconds=1)) == 1
+
+    changes = client.get(f"/tasks/changes?since={watermark}", headers=hdr).json()
+    assert changes["deleted"] == [newest["id"]]
+
+    # The highest id was archived: a new task must not take it again
+    later = client.post("/tasks/", json={"title": "later"}, headers=hdr).json()
+    assert later["id"] > newest["id"]
+    ids = [t["id"] for t in client.get("/tasks/?include_archived=true", headers=hdr).json()]
+    assert sorted(ids) == [newest["id"], later["id"]]
+
+    # Archived tasks can be deleted like live ones
+    assert client.delete(f"/tasks/{newest['id']}", headers=hdr).status_code == 200
+    ids = [t["id"] for t in client.get("/tasks/?include_archived=true", headers=hdr).json()]
+    assert ids == [later["id"]]
+    assert client.delete(f"/tasks/{newest['id']}", headers=hdr).status_code == 404
+
+def test_archiver_sweep_skips_users_being_moved(monkeypatch):
+    from app import jobs, models
+    from app.database import SessionLocal
+
+    monkeypatch.setattr(jobs, "TASK_ARCHIVE_AFTER_DAYS", -1)
+    tasks = {}
+    for username in ("nell", "noah"):
+        client.post("/register", json={"username": username, "password": "pw"})
+        token = client.post("/login", data={"username": username, "password": "pw"}).json()["access_token"]
+        hdr = {"Authorization": f"Bearer {token}"}
+        tasks[username] = client.post("/tasks/", json={"title": "done"}, headers=hdr).json()["id"]
+        client.post(f"/tasks/{tasks[username]}/complete", headers=hdr)
+
+    with SessionLocal() as db:
+        db.get(models.User, _user_id("nell")).shard_moving = True
+        db.commit()
+        assert jobs._archive_tasks(db, user_id=None) == 1
+        assert db.get(models.Task, tasks["nell"]) is not None
+        assert db.get(models.TaskArchive, tasks["noah"]) is not None
+
+# ── Sharding ───────────────────────────────────────────────
+
+def test_shard_ring_placement_is_stable():
+    from app.database import ShardRing
+
+    ring = ShardRing(["default", "s1", "s2"])
+    placed = {f"user{i}": ring.shard_for(f"user{i}") for i in range(300)}
+    assert set(placed.values()) == {"default", "s1", "s2"}
+
+    # Adding a shard only moves keys onto the new shard
+    bigger = ShardRing(["default", "s1", "s2", "s3"])
+    for key, shard in placed.items():
+        assert bigger.shard_for(key) in (shard, "s3")
+
+def test_move_user_between_shards(tmp_path):
+    from datetime import datetime, timedelta
+    from app import crud, database, shards
+
+    client.post("/register", json={"username": "mona", "password": "pw"})
+    token = client.post("/login", data={"username": "mona","password":"pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+    kept = client.post("/books/", json={
+        "book_name":"Kept", "description":"", "pages":1, "author":"A","publisher":"P"
+    }, headers=hdr).json()
+    gone = client.post("/books/", json={
+        "book_name":"Gone", "description":"", "pages":1, "author":"A","publisher":"P"
+    }, headers=hdr).json()
+    watermark = client.get("/books/changes", headers=hdr).json()["watermark"]
+    client.delete(f"/books/{gone['id']}", headers=hdr)
+    done = client.post("/tasks/", json={"title": "archived"}, headers=hdr).json()
+    client.post(f"/tasks/{done['id']}/complete", headers=hdr)
+    with database.SessionLocal() as db:
+        crud.archive_completed_tasks(db, datetime.utcnow() + timedelta(seconds=1))
+
+    database.add_shard("s2", f"sqlite:///{tmp_path}/s2.db")
+    try:
+        Base.metadata.create_all(bind=database.shard_engines["s2"])
+        counts = shards.move_user(_user_id("mona"), "s2", grace=0)
+        assert counts == {"books": 1, "tasks": 1}
+
+        # Archived tasks stay in the archive
+        assert client.get("/tasks/", headers=hdr).json() == []
+        archived = client.get("/tasks/?include_archived=true", headers=hdr).json()
+        assert [t["title"] for t in archived] == ["archived"]
+
+        books = client.get("/books/", headers=hdr).json()
+        assert [b["book_name"] for b in books] == ["Kept"]
+
+        # A client holding the old watermark drops the old ids and picks up the moved rows
+        r = client.get(f"/books/changes?since={watermark}", headers=hdr).json()
+        assert sorted(r["deleted"]) == sorted([kept["id"], gone["id"]])
+        assert [b["book_name"] for b in r["changed"]] == ["Kept"]
+        assert r["watermark"] > watermark
+
+        # Writes keep working on the new shard
+        r = client.post("/tasks/", json={"title": "after move"}, headers=hdr)
+        assert r.status_code == 200
+    finally:
+        shards.move_user(_user_id("mona"), "default", grace=0)
+        database.remove_shard("s2")
+
+    assert [b["book_name"] for b in client.get("/books/", headers=hdr).json()] == ["Kept"]
+
+def test_move_user_waits_for_running_jobs(monkeypatch, tmp_path):
+    from app import database, models, shards
+
+    client.post("/register", json={"username": "nils", "password": "pw"})
+    user_id = _user_id("nils")
+    with database.SessionLocal() as db:
+        db.add(models.Job(user_id=user_id, kind="import_books", status="running"))
+        db.commit()
+
+    monkeypatch.setattr(shards, "SHARD_MOVE_JOB_WAIT_SECONDS", 0.3)
+    database.add_shard("s2", f"sqlite:///{tmp_path}/s2.db")
+    try:
+        Base.metadata.create_all(bind=database.shard_engines["s2"])
+        with pytest.raises(RuntimeError, match="running job"):
+            shards.move_user(user_id, "s2", grace=0)
+    finally:
+        database.remove_shard("s2")
+
+    with database.SessionLocal() as db:
+        user = db.get(models.User, user_id)
+        assert (user.shard or "default") == "default" and not user.shard_moving
+
+def _user_id(username):
+    from app import crud
+    from app.database import SessionLocal
+    with SessionLocal() as db:
+        return crud.get_user_by_username(db, username).id
+
+# ── Profiling ──────────────────────────────────────────────
+
+def test_profile_requested_by_admin(tmp_path, monkeypatch):
+    import asyncio
+    from app import auth, profiling
+
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    # Profiles are written from a worker thread, not on the event loop
+    on_loop = []
+    save = profiling.save_profile
+    def save_profile(session):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        save(session)
+    monkeypatch.setattr(profiling, "save_profile", save_profile)
+
+    client.post("/register", json={"username": "nina", "password": "pw"})
+    token = client.post("/login", data={"username": "nina","password":"pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+
+    # Without a valid admin token the header is ignored
+    r = client.get("/books/", headers={**hdr, "X-Profile": "1", "X-Admin-Token": "wrong"})
+    assert "x-profile-id" not in r.headers
+
+    admin = {"X-Admin-Token": "s3cret"}
+    r = client.get("/books/", headers={**hdr, **admin, "X-Profile": "1"})
+    assert r.status_code == 200
+    profile_id = r.headers["x-profile-id"]
+
+    profile = client.get(f"/admin/profiles/{profile_id}", headers=admin).json()
+    assert profile["route"] == "/books/" and profile["status"] == 200
+    assert profile["query_count"] >= 2  # current user + books
+
+    listed = client.get("/admin/profiles", headers=admin).json()
+    assert [p["id"] for p in listed] == [profile_id]
+    assert on_loop == [False]
+
+    r = client.get(f"/admin/profiles/{profile_id}/collapsed", headers=admin)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+
+    assert client.get("/admin/profiles").status_code == 403
+
+# ── Slow query log ─────────────────────────────────────────
+
+def test_slow_query_log_captures_plan(monkeypatch):
+    from app import auth, querylog
+
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(querylog, "SLOW_QUERY_THRESHOLD_MS", 0)
+    admin = {"X-Admin-Token": "s3cret"}
+    client.delete("/admin/slow-queries", headers=admin)
+
+    client.post("/register", json={"username": "omar", "password": "pw"})
+    token = client.post("/login", data={"username": "omar","password":"pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+    client.get("/books/?author=Ann", headers=hdr)
+    client.get("/books/?author=Bob", headers=hdr)
+
+    queries = client.get("/admin/slow-queries", headers=admin).json()["queries"]
+    books = [q for q in queries if "FROM books" in q["fingerprint"] and "authors.name LIKE" in q["fingerprint"]]
+    assert len(books) == 1                     # both filters share one fingerprint
+    assert books[0]["count"] == 2
+    assert books[0]["plan"]                    # EXPLAIN QUERY PLAN captured once
+    assert "Ann" not in books[0]["fingerprint"]
+
+def test_failed_postgres_explain_is_rolled_back_to_a_savepoint():
+    from app import deadlines, querylog
+
+    executed = []
+
+    class FakeCursor:
+        connection = None
+        def execute(self, sql, parameters=None):
+            executed.append(sql)
+            if sql.startswith("EXPLAIN"):
+                raise RuntimeError("canceling statement due to statement timeout")
+        def close(self):
+            pass
+
+    cursor = FakeCursor()
+    cursor.connection = type("FakeConnection", (), {"cursor": lambda self: cursor})()
+    token = deadlines.current_deadline.set(deadlines.Deadline(5))
+    try:
+        plan = querylog._explain("postgresql", cursor, "SELECT 1", {})
+    finally:
+        deadlines.current_deadline.reset(token)
+
+    assert plan[0].startswith("EXPLAIN failed")
+    # No ANALYZE re-run inside a request, and the transaction stays usable
+    assert executed == ["SAVEPOINT querylog_explain", "EXPLAIN SELECT 1", "ROLLBACK TO SAVEPOINT querylog_explain"]
+
+def test_failed_statements_leave_no_start_times_on_the_connection():
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+            conn.rollback()
+        conn.execute(text("SELECT 1"))
+        assert not conn.info.get("querylog_start")
+
+# ── Password hashing policy ────────────────────────────────
+
+def test_calibrate_rounds_meets_target():
+    from app.hashing import calibrate_rounds
+
+    # 20 ms at cost 10, doubling per round: cost 13 = 160 ms, cost 14 = 320 ms
+    timer = lambda rounds: 20 * 2 ** (rounds - 10)
+    assert calibrate_rounds(250, 10, 16, timer=timer) == 13
+    assert calibrate_rounds(250, 10, 12, timer=timer) == 12       # capped
+    assert calibrate_rounds(5, 10, 16, timer=timer) == 10         # slow host keeps the floor
+
+def test_login_rehashes_outdated_hash():
+    from app import crud, hashing
+    from app.database import SessionLocal
+
+    saved = hashing.pwd_context.to_dict()
+    try:
+        hashing.apply_policy(4)
+        client.post("/register", json={"username": "pia", "password": "pw"})
+
+        hashing.apply_policy(5)
+        r = client.post("/login", data={"username": "pia", "password": "pw"})
+        assert r.status_code == 200
+
+        with SessionLocal() as db:
+            stored = crud.get_user_by_username(db, "pia").hashed_password
+        assert stored.startswith("$2b$05$")
+
+        # Still logs in with the upgraded hash; a stronger hash is not downgraded
+        hashing.apply_policy(4)
+        assert client.post("/login", data={"username": "pia", "password": "pw"}).status_code == 200
+        with SessionLocal() as db:
+            assert crud.get_user_by_username(db, "pia").hashed_password == stored
+    finally:
+        hashing.pwd_context.load(saved)
+
+# ── Request deadlines ──────────────────────────────────────
+
+def test_deadline_answers_504_and_caps_header():
+    import asyncio
+    from app import deadlines
+
+    async def slow_app(scope, receive, send):
+        await asyncio.sleep(0.5)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"late"})
+
+    slow_client = TestClient(deadlines.DeadlineMiddleware(slow_app))
+    before = deadlines.stats["timeouts"]
+    r = slow_client.get("/", headers={"X-Request-Timeout": "0.05"})
+    assert r.status_code == 504
+    assert deadlines.stats["timeouts"] == before + 1
+
+    scope = {"path": "/", "headers": [(b"x-request-timeout", b"3600")]}
+    assert deadlines.deadline_for(scope) == deadlines.REQUEST_DEADLINE_MAX_SECONDS
+
+def test_expired_deadline_interrupts_sqlite_query():
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+    from app import deadlines
+    from app.database import SessionLocal
+
+    slow_query = text(
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+        "SELECT count(*) FROM n"
+    )
+    deadline = deadlines.Deadline(0.05)
+    token = deadlines.current_deadline.set(deadline)
+    try:
+        with SessionLocal() as db:
+            with pytest.raises(OperationalError, match="interrupted"):
+                db.execute(slow_query)
+    finally:
+        deadlines.current_deadline.reset(token)
+
+def test_deadline_interrupting_a_query_answers_504():
+    from fastapi import FastAPI
+    from sqlalchemy import text
+    from app import deadlines
+    from app.database import SessionLocal
+
+    slow_app = FastAPI()
+
+    @slow_app.get("/slow")
+    def slow():
+        with SessionLocal() as db:
+            return db.execute(text(
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+                "SELECT count(*) FROM n"
+            )).scalar()
+
+    slow_app.add_middleware(deadlines.DeadlineMiddleware)  # Same place in the stack as in app.main
+    slow_client = TestClient(slow_app, raise_server_exceptions=False)
+    before = dict(deadlines.stats)
+    for _ in range(3):
+        r = slow_client.get("/slow", headers={"X-Request-Timeout": "0.3"})
+        assert r.status_code == 504
+    assert deadlines.stats["timeouts"] == before["timeouts"] + 3
+    assert deadlines.stats["interrupted_queries"] >= before["interrupted_queries"] + 3
+
+# ── Group commit ───────────────────────────────────────────
+
+def test_group_commit_batches_task_writes(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from app import groupcommit
+
+    committer = groupcommit.GroupCommitter(window_ms=100, max_batch=16)
+    monkeypatch.setattr(groupcommit, "GROUP_COMMIT", True)
+    monkeypatch.setattr(groupcommit, "committer", committer)
+
+    client.post("/register", json={"username": "hugo", "password": "pw"})
+    token = client.post("/login", data={"username": "hugo", "password": "pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+
+    def create(i):
+        return client.post("/tasks/", json={"title": f"t{i}"}, headers=hdr)
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            created = list(pool.map(create, range(8)))
+            missing = pool.submit(client.post, "/tasks/999999/complete", headers=hdr)
+            assert missing.result().status_code == 404      # fails alone
+        assert [r.status_code for r in created] == [200] * 8
+        assert len({r.json()["id"] for r in created}) == 8
+
+        task_id = created[0].json()["id"]
+        assert client.post(f"/tasks/{task_id}/complete", headers=hdr).status_code == 200
+        r = client.put(f"/tasks/{task_id}", json={"title": "renamed"}, headers=hdr)
+        assert r.json()["title"] == "renamed" and r.json()["completed"] is True
+    finally:
+        committer.stop()
+
+    assert committer.stats["writes"] == 10
+    assert committer.stats["batches"] < committer.stats["writes"]
+    assert len(client.get("/tasks/?limit=100", headers=hdr).json()) == 8
+
+def test_group_commit_does_not_starve_the_pool(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from app import deadlines, groupcommit
+
+    # More waiting writers than the pool has connections, all in one batch
+    writers = engine.pool.size() + engine.pool._max_overflow + 5
+    committer = groupcommit.GroupCommitter(window_ms=500, max_batch=writers)
+    monkeypatch.setattr(groupcommit, "GROUP_COMMIT", True)
+    monkeypatch.setattr(groupcommit, "committer", committer)
+    monkeypatch.setattr(deadlines, "REQUEST_DEADLINE_SECONDS", 5)
+
+    client.post("/register", json={"username": "iris", "password": "pw"})
+    token = client.post("/login", data={"username": "iris", "password": "pw"}).json()["access_token"]
+    hdr = {"Authorization": f"Bearer {token}"}
+
+    try:
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            created = list(pool.map(lambda i: client.post("/tasks/", json={"title": f"t{i}"}, headers=hdr), range(writers)))
+    finally:
+        committer.stop()
+    assert [r.status_code for r in created] == [200] * writers
+
+def test_group_commit_survives_a_failed_batch(monkeypatch):
+    from sqlalchemy.exc import OperationalError
+    from app import groupcommit, models
+    from app.database import get_shard_sessionmaker
+
+    client.post("/register", json={"username": "ivy", "password": "pw"})
+    outage = {"left": 1}
+
+    def flaky_sessionmaker(shard):
+        if outage["left"]:
+            outage["left"] -= 1
+            raise OperationalError("connect", {}, Exception("database is locked"))
+        return get_shard_sessionmaker(shard)
+
+    monkeypatch.setattr(groupcommit, "get_shard_sessionmaker", flaky_sessionmaker)
+    committer = groupcommit.GroupCommitter(window_ms=1)
+    count_users = lambda db: db.query(models.User).count()
+    try:
+        with pytest.raises(OperationalError):
+            committer.run(None, count_users)
+        assert committer.run(None, count_users) == 1      # The flusher is still alive
+    finally:
+        committer.stop()
+
+# ── Embedded SQLite mode ───────────────────────────────────
+
+def test_tuned_sqlite_routes_reads_to_reader_pool():
+    from sqlalchemy import select, text
+    from app import database, models
+    if engine not in database.sqlite_readers:
+        pytest.skip("needs DATABASE_URL pointing at a SQLite file with SQLITE_TUNED=1")
+
+    with database.SessionLocal() as db:
+        assert db.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        db.rollback()
+        assert db.get_bind(clause=select(models.User)) is database.sqlite_readers[engine]
+
+        # After a write the session reads from the writer and sees its own rows
+        db.add(models.User(username="writer", hashed_password="!"))
+        db.flush()
+        assert db.get_bind(clause=select(models.User)) is engine
+        assert db.execute(select(models.User.username)).scalar() == "writer"
+        db.commit()
+        assert db.get_bind(clause=select(models.User)) is database.sqlite_readers[engine]
+
+# ── Connection use per request ─────────────────────────────
+
+def test_task_write_checks_out_one_connection():
+    from sqlalchemy import event
+    client.post("/register", json={"username": "pooled", "password": "pw"})
+    token = client.post("/login", data={"username": "pooled", "password": "pw"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    checkouts = []
+    count = lambda dbapi_connection, record, proxy: checkouts.append(record)
+    event.listen(engine.pool, "checkout", count)
+    try:
+        r = client.post("/tasks/", json={"title": "one connection"}, headers=headers)
+        assert r.status_code == 200
+        r = client.put(f"/tasks/{r.json()['id']}", json={"completed": True}, headers=headers)
+        assert r.status_code == 200 and r.json()["completed"] is True
+    finally:
+        event.remove(engine.pool, "checkout", count)
+    # Written, refreshed and committed on one checkout; the response is
+    # serialized without going back to the pool
+    assert len(checkouts) == 2